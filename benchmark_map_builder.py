@@ -0,0 +1,266 @@
+"""Time the stages of the build pipeline against synthetic hikes, .gpx files
+    and stations (by default at 100, 1,000 and 10,000 hikes), and append the
+    results to benchmark_results.csv with the current commit, so that each
+    run is compared with the latest one from an earlier commit.
+
+    python benchmark_map_builder.py [--sizes 100 1000] [--points 500]
+"""
+import os
+import time
+import shutil
+import zipfile
+import tempfile
+import argparse
+import subprocess
+import webbrowser
+import numpy as np
+import polars as pl
+import arrow
+import map_builder as mb
+
+repo_folder = os.path.dirname(os.path.abspath(__file__))
+results_file = os.path.join(repo_folder, "benchmark_results.csv")
+results_schema = {"Commit": pl.String, "Timestamp": pl.Int64,
+                  "Hikes": pl.Int64, "Stage": pl.String, "Seconds": pl.Float64}
+hike_columns = ["Date", "Title", "Attendees", "URL", "Source"]
+
+
+def run_benchmarks(sizes: [int], points_per_hike: int, repeat: int) -> pl.DataFrame:
+    webbrowser.open = lambda *args, **kwargs: True
+    mb.downloads_path = "downloads"
+    results = []
+    home = os.getcwd()
+    for hikes in sizes:
+        work_folder = tempfile.mkdtemp(prefix=f"map_benchmark_{hikes}_")
+        os.chdir(work_folder)
+        try:
+            print(f"\n{hikes} hikes, {points_per_hike} points each:")
+            clear_caches()
+            df_hikes = write_fixtures(hikes, points_per_hike)
+            results += [(hikes, stage, seconds) for stage, seconds
+                        in time_pipeline(df_hikes, repeat)]
+        finally:
+            os.chdir(home)
+            shutil.rmtree(work_folder, ignore_errors=True)
+    return pl.DataFrame(
+        [(current_commit(), int(arrow.now().timestamp()), *result)
+         for result in results],
+        schema=results_schema, orient="row"
+    )
+
+
+def time_pipeline(df_hikes: pl.DataFrame, repeat: int) -> [(str, float)]:
+    timings = []
+
+    def timed(stage: str, function, *args, runs: int = repeat, **kwargs):
+        best, result = np.inf, None
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            best = min(best, time.perf_counter() - start)
+        print(f"\t{stage}: {best:.3f}sec")
+        timings.append((stage, best))
+        return result
+
+    timed("find_all_gpx_files (no index)", mb.find_all_gpx_files, runs=1)
+    timed("find_all_gpx_files", mb.find_all_gpx_files)
+    routes = timed(
+        "gpxpy_points_from_gpx_file",
+        lambda: [mb.gpxpy_points_from_gpx_file(f) for f in df_hikes["GPX"]]
+    )
+    timed("get_total_distance",
+          lambda: [mb.get_total_distance(route) for route in routes])
+    timed("find_proximate_station",
+          lambda: [mb.find_proximate_station(route[i_pt])
+                   for route in routes for i_pt in (0, -1)])
+    mb.save_routes({
+        url: pl.DataFrame({"lat": [pt.latitude for pt in route],
+                           "long": [pt.longitude for pt in route]})
+        for route, url in zip(routes, df_hikes["URL"])
+    })
+    df_details = timed("rebuild_hike_details", mb.rebuild_hike_details)
+    df_details.write_csv("HikeDetails.csv")
+    timed("make_line",
+          lambda: [mb.make_line(hike)
+                   for hike in df_details.iter_rows(named=True)])
+    timed("new_map", mb.new_map, runs=1)
+    timed("new_map (incremental, first build)", mb.new_map,
+          incremental=True, runs=1)
+    timed("new_map (incremental)", mb.new_map, incremental=True)
+    return timings
+
+
+def clear_caches():
+    """so that nothing loaded for one set of fixtures is used for the next"""
+    for item in vars(mb).values():
+        if hasattr(item, "cache_clear"):
+            item.cache_clear()
+    mb.profile_counts.clear()
+
+
+def write_fixtures(hikes: int, points_per_hike: int) -> pl.DataFrame:
+    """Write stations, the hike lists and a .gpx file for each hike into the
+        current folder, laid out as map_builder expects.  Returns the hikes"""
+    rng = np.random.default_rng(hikes)
+    write_stations(rng)
+    first_date = arrow.get("2000-01-01")
+    df_hikes = pl.DataFrame(
+        {
+            "Date": [first_date.shift(days=i).format("YYYY-MM-DD")
+                     for i in range(hikes)],
+            "Title": [f"Benchmark hike {i} ({10 + i % 15} miles)"
+                      for i in range(hikes)],
+            "Attendees": rng.integers(5, 60, hikes),
+            "URL": [f"{100_000_000 + i}" for i in range(hikes)],
+            "Source": ["Free"] * hikes,
+            "GPX": [f"gpx\\{1 + i % 10:02}\\benchmark_hike_{i}.gpx"
+                    for i in range(hikes)],
+        }
+    )
+    write_meetup_scrape(df_hikes[:-2])
+    df_hikes[-1:].select(hike_columns).write_csv(mb.scraped_hikes_file)
+    write_ods("ManuallyAddedHikes.ods", df_hikes[-2:-1].select(hike_columns))
+    write_ods("ManualStartEnd.ods", pl.DataFrame(
+        {"URL": df_hikes["URL"][:1], "Start": ["Start"], "End": ["End"]}))
+    os.makedirs(mb.downloads_path, exist_ok=True)
+    for folder in {f"gpx\\{1 + i % 10:02}" for i in range(hikes)} | {"page"}:
+        os.makedirs(folder, exist_ok=True)
+    os.makedirs("routes", exist_ok=True)
+    for date, gpx_file in df_hikes.select("Date", "GPX").iter_rows():
+        write_gpx(gpx_file, date, rng, points_per_hike)
+    return df_hikes
+
+
+def write_stations(rng: np.random.Generator, stations: int = 2_500):
+    mainline_file, tube_file = mb.station_files
+    pl.DataFrame(
+        {
+            "station_crs": [f"B{i:04}" for i in range(stations)],
+            "station_name": [f"Station {i} Rail Station"
+                             for i in range(stations)],
+            "latitude": rng.uniform(50.8, 52.2, stations),
+            "longitude": rng.uniform(-1.2, 1.0, stations),
+        }
+    ).write_csv(mainline_file)
+    tube_stations = stations // 10
+    pl.DataFrame(
+        {
+            "FID": range(tube_stations), "OBJECTID": range(tube_stations),
+            "NAME": [f"Tube {i}" for i in range(tube_stations)],
+            **{column: [0] * tube_stations for column in "abcde"},
+            "y": rng.uniform(51.4, 51.6, tube_stations),
+            "x": rng.uniform(-0.4, 0.1, tube_stations),
+        }
+    ).write_csv(tube_file)
+
+
+def write_meetup_scrape(df_hikes: pl.DataFrame):
+    """Hikes.txt, in the form of the text of the Past Events page"""
+    with open("Hikes.txt", "w") as file:
+        for date, title, attendees, url, _, _ in df_hikes.iter_rows():
+            file.write(f"{arrow.get(date).format('ddd, MMM D, YYYY')}, "
+                       f"9:30 AM GMT\n{title}\nThis event has passed\n"
+                       f"{attendees} attendees, hosted by Chris\n"
+                       f"https://www.meetup.com/free-outdoor-trips-from-london"
+                       f"/events/{url}/\n")
+
+
+def write_gpx(filename: str, date: str, rng: np.random.Generator,
+              points: int):
+    lats = rng.uniform(51.2, 51.8) + np.cumsum(rng.normal(0, 0.0002, points))
+    longs = rng.uniform(-0.8, 0.6) + np.cumsum(rng.normal(0, 0.0003, points))
+    track_points = "".join(
+        f'<trkpt lat="{lat:.6f}" lon="{long:.6f}"><ele>50.0</ele>'
+        f'<time>{date}T09:{i // 60 % 60:02}:{i % 60:02}Z</time></trkpt>\n'
+        for i, (lat, long) in enumerate(zip(lats, longs))
+    )
+    with open(filename, "w", encoding="utf-8") as gpx_file:
+        gpx_file.write(
+            f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<gpx version="1.1" creator="benchmark" '
+            f'xmlns="http://www.topografix.com/GPX/1/1">\n'
+            f'<metadata><time>{date}T09:00:00Z</time></metadata>\n'
+            f'<trk><trkseg>\n{track_points}</trkseg></trk>\n</gpx>\n'
+        )
+
+
+def write_ods(filename: str, df: pl.DataFrame):
+    """the smallest OpenDocument spreadsheet that read_ods will load"""
+
+    def cell(value) -> str:
+        if isinstance(value, (int, float)):
+            return (f'<table:table-cell office:value-type="float" '
+                    f'office:value="{value}"/>')
+        return (f'<table:table-cell office:value-type="string">'
+                f'<text:p>{value}</text:p></table:table-cell>')
+
+    rows = "".join(
+        f"<table:table-row>{''.join(cell(value) for value in row)}"
+        f"</table:table-row>"
+        for row in [df.columns, *df.iter_rows()]
+    )
+    namespaces = " ".join(
+        f'xmlns:{prefix}="urn:oasis:names:tc:opendocument:xmlns:{name}:1.0"'
+        for prefix, name in (("office", "office"), ("table", "table"),
+                             ("text", "text"))
+    )
+    manifest_namespace = "urn:oasis:names:tc:opendocument:xmlns:manifest:1.0"
+    mime_type = "application/vnd.oasis.opendocument.spreadsheet"
+    with zipfile.ZipFile(filename, "w") as ods:
+        ods.writestr("mimetype", mime_type)
+        ods.writestr(
+            "META-INF/manifest.xml",
+            f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<manifest:manifest xmlns:manifest="{manifest_namespace}">'
+            f'<manifest:file-entry manifest:full-path="/" '
+            f'manifest:media-type="{mime_type}"/>'
+            f'<manifest:file-entry manifest:full-path="content.xml" '
+            f'manifest:media-type="text/xml"/></manifest:manifest>'
+        )
+        ods.writestr(
+            "content.xml",
+            f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<office:document-content {namespaces} office:version="1.2">'
+            f'<office:body><office:spreadsheet><table:table table:name="Sheet1">'
+            f'{rows}</table:table></office:spreadsheet></office:body>'
+            f'</office:document-content>'
+        )
+
+
+def current_commit() -> str:
+    return subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=repo_folder, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def save_and_compare(df_results: pl.DataFrame):
+    """Append the results to the results file, and show them alongside
+        the latest results from a different commit"""
+    df_history = (pl.read_csv(results_file, schema=results_schema)
+                  if os.path.exists(results_file)
+                  else pl.DataFrame(schema=results_schema))
+    df_previous = df_history.filter(
+        pl.col("Commit") != df_results["Commit"][0]
+    ).sort("Timestamp").group_by("Hikes", "Stage").last()
+    print(f"\n{'Stage':<40}{'Hikes':>7}{'Seconds':>10}{'Before':>10}"
+          f"{'Ratio':>8}")
+    for hikes, stage, seconds, before in df_results.join(
+            df_previous, on=["Hikes", "Stage"], how="left"
+    ).select("Hikes", "Stage", "Seconds", "Seconds_right").iter_rows():
+        change = f"{before:>10.3f}{seconds / before:>7.2f}x" if before else ""
+        print(f"{stage:<40}{hikes:>7}{seconds:>10.3f}{change}")
+    pl.concat([df_history, df_results]).write_csv(results_file)
+
+
+if __name__ == "__main__":
+    my_parser = argparse.ArgumentParser(description="Map builder benchmarks")
+    my_parser.add_argument("--sizes", type=int, nargs="+",
+                           default=[100, 1_000, 10_000],
+                           help="numbers of hikes to benchmark with")
+    my_parser.add_argument("--points", type=int, default=500,
+                           help="track points in each .gpx file")
+    my_parser.add_argument("--repeat", type=int, default=3,
+                           help="runs of each stage (best is kept)")
+    args = my_parser.parse_args()
+    save_and_compare(run_benchmarks(args.sizes, args.points, args.repeat))
@@ -2,105 +2,340 @@
     to be pushed to GitHub for use in GitHub pages"""
 import os
 import shutil
+import functools
+import collections
+import itertools
+import contextlib
+import tracemalloc
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import polars as pl
+import numpy as np
 import arrow
 import re
 import requests
+import urllib.parse
 from bs4 import BeautifulSoup as bs
 import gpxpy
 from gpxpy import geo
 import folium
+from folium.plugins import VectorGridProtobuf
 import geojson
 import argparse
 import json
+import math
+import xml.etree.ElementTree as ET
+import hashlib
+import bisect
+import gzip
+import sqlite3
+from jinja2 import Template
 import gpx_folders_key
 import webbrowser
 
 
 downloads_path = "C:\\Users\\j_a_c\\Downloads"
-
-
-def new_map():
+cache_folder = "cache"
+station_files = ("uk-train-stations.csv", "Stations 20180921.csv")
+route_store_file = "routes\\routes.arrow"
+route_stage_file = "routes\\staged.arrow"  # saved since last compacted
+profile_counts = collections.Counter()
+profiling = False   # set by --profile: time stages and track their memory
+stage_profiles = {}
+stage_peaks = []    # peak traced memory so far of each stage in progress
+profile_report_file = "page\\build_profile.json"
+fragment_folder = f"{cache_folder}\\fragments"
+year_tiles_folder = "routes"     # relative to page, for tiled mode
+meetup_past_events_url = ("https://www.meetup.com/"
+                          "free-outdoor-trips-from-london/events/?type=past")
+meetup_host_id = "14080424"
+upload_rules_file = "gpx_upload_rules.json"
+meetup_pages_file = f"{cache_folder}\\meetup_pages.json"
+scraped_hikes_file = "ScrapedHikes.csv"
+history_folder = "Previous Hike Details"
+gpx_index_file = f"{cache_folder}\\gpx_index.parquet"
+gpx_index_schema = {
+    "filename": pl.String, "mod_timestamp": pl.Float64, "size": pl.Int64,
+    "Date": pl.String, "points": pl.Int64,
+    "min_latitude": pl.Float64, "max_latitude": pl.Float64,
+    "min_longitude": pl.Float64, "max_longitude": pl.Float64,
+}
+route_style = {"color": "blue", "opacity": 0.3, "weight": 8}
+route_highlight = {"color": "red", "opacity": 1.0, "weight": 3}
+polyline_precision = 5      # decimal places kept by compact mode (~1m)
+significance_floor = 5      # metres, see route_significance
+lod_levels = ((0, 100), (11, 25), (13, 8), (15, 0))     # (min. zoom, metres)
+network_cell_metres = 25    # grid that routes are snapped to, see route_network
+vector_tiles_archive = "routes\\hikes.mbtiles"
+vector_tiles_folder = "tiles"    # relative to page, see export_vector_tiles
+vector_tiles_page = "page\\tile_map.html"
+vector_tile_zooms = (5, 14)     # (min., max.) zoom levels exported
+vector_tile_extent = 4096       # tile units across a tile
+vector_tile_buffer = 64         # tile units that routes run on past each edge
+snips_file = "gpx_snips.csv"    # see snip_gpx_files
+snip_radius_metres = 100
+route_layer_js = f"""
+    function routeLayerOptions() {{
+        return {{
+            style: function (feature) {{ return {json.dumps(route_style)}; }},
+            onEachFeature: function (feature, layer) {{
+                layer.bindTooltip(feature.properties.tooltip, {{sticky: true}});
+                if (feature.properties.levels) {{
+                    levelOfDetail(layer, feature.properties.levels);
+                }}
+                layer.on({{
+                    mouseover: function (e) {{
+                        e.target.setStyle({json.dumps(route_highlight)});
+                    }},
+                    mouseout: function (e) {{
+                        e.target.setStyle({json.dumps(route_style)});
+                    }}
+                }});
+            }}
+        }};
+    }}
+
+    function routeFeatures(features) {{
+        features.forEach(function (feature) {{
+            if (feature.properties.polyline) {{
+                feature.geometry = {{
+                    type: "LineString",
+                    coordinates: decodePolyline(feature.properties.polyline)
+                }};
+                delete feature.properties.polyline;
+            }}
+        }});
+        return {{type: "FeatureCollection", features: features}};
+    }}
+
+    function levelOfDetail(layer, levels) {{
+        var allLatLngs = layer.getLatLngs(), shownLevel = null;
+        function showLevel() {{
+            if (!layer._map) {{ return; }}
+            var zoom = layer._map.getZoom(), level = -1;
+            {json.dumps([zoom for zoom, _ in lod_levels])}.forEach(function (minZoom) {{
+                if (zoom >= minZoom) {{ level++; }}
+            }});
+            if (level !== shownLevel) {{
+                shownLevel = level;
+                layer.setLatLngs(allLatLngs.filter(function (latlng, i) {{
+                    return levels.charCodeAt(i) - 48 <= level;
+                }}));
+            }}
+        }}
+        layer.on("add", function () {{
+            showLevel();
+            layer._map.on("zoomend", showLevel);
+        }});
+        layer.on("remove", function () {{
+            layer._map.off("zoomend", showLevel);
+        }});
+    }}
+
+    function lazyRouteLayer(group, url) {{
+        var requested = false;
+        function load() {{
+            if (requested) {{ return; }}
+            requested = true;
+            fetch(url).then(function (response) {{
+                return response.json();
+            }}).then(function (features) {{
+                L.geoJson(routeFeatures(features), routeLayerOptions()).addTo(group);
+            }});
+        }}
+        group.on("add", load);
+        if (group._map) {{ load(); }}
+    }}
+
+    function decodePolyline(text) {{
+        var factor = Math.pow(10, {polyline_precision}), values = [];
+        var index = 0, value = 0, shift = 0, chunk;
+        while (index < text.length) {{
+            chunk = text.charCodeAt(index++) - 63;
+            value |= (chunk & 0x1f) << shift;
+            shift += 5;
+            if (chunk < 0x20) {{
+                values.push(value & 1 ? ~(value >> 1) : value >> 1);
+                value = 0;
+                shift = 0;
+            }}
+        }}
+        var coordinates = [], lat = 0, long = 0;
+        for (var i = 0; i < values.length; i += 2) {{
+            lat += values[i];
+            long += values[i + 1];
+            coordinates.push([long / factor, lat / factor]);
+        }}
+        return coordinates;
+    }}
+"""
+
+
+def new_map(incremental: bool = False, compact: bool = False,
+            tiled: bool = False, lod: bool = False, grouped: bool = False,
+            network: bool = False):
+    """Write page\\map.html.  In incremental mode each hike's route is
+        rendered once to a GeoJSON fragment and cached, and only new or
+        changed hikes (route or HikeDetails row) are rendered again.
+        Compact mode (which also uses the fragments) embeds each route as
+        an encoded polyline, decoded in the browser, rather than as
+        full-precision coordinates.
+        Tiled mode writes each year's routes to page\\routes\\<year>.json
+        instead of into the page.  Only the latest year is shown (and so
+        fetched) at first; each other year is fetched when it is switched
+        on in the layer control.  NB. browsers won't fetch from a file://
+        page, so the local copy opened at the end shows no routes.
+        With lod (level of detail), each route is drawn simplified to
+        suit the zoom level, as set out in lod_levels.
+        Grouped mode (which takes precedence over the others) draws each
+        year's routes as one folium.GeoJson, with a shared style and
+        tooltip, rather than one per hike.
+        With network, a layer (off at first) is added which draws each
+        path used by the hikes once, see network_layer"""
     print("Building map:")
     dfh = read_hike_details()
-    m = folium.Map(location=(51.5, -0.15), tiles=folium.TileLayer("cartodb positron", name="Clear"), zoom_start=9)
-    folium.TileLayer('https://tile.thunderforest.com/transport/{z}/{x}/{y}.png?apikey=a23a350629204ae8b1e22f0729186cb1',
-                     attr='&copy; <a href="http://www.thunderforest.com/">Thunderforest</a>, &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
-                     name="Railways").add_to(m)
-    fg_by_year = {year: folium.FeatureGroup(name=f"{year}")
-                  for year in dfh["Date"].str.slice(0, 4).unique()}
+    m = base_map()
+    years = dfh["Date"].str.slice(0, 4).unique()
+    fg_by_year = {year: folium.FeatureGroup(
+                        name=f"{year}", show=not tiled or year == years.max())
+                  for year in years}
     walks_on_map, aggregate_distance = 0, 0
-    print("\tHikes on map: ", end=" " * 3)
-    for hike in dfh.iter_rows(named=True):
-        year_fg = fg_by_year[hike["Date"][:4]]
-        make_line(hike).add_to(year_fg)
-        walks_on_map += 1
-        print(f"{'\b' * 3}{walks_on_map:>3}", end="", flush=True)
-        aggregate_distance += hike["Distance"]
-    print("")
+    with profile_stage("rendering"):
+        if incremental or compact or tiled or lod or grouped:
+            fragments = route_fragments(dfh, compact and not grouped,
+                                        lod and not grouped)
+            for year, year_fg in fg_by_year.items():
+                year_fragments = [
+                    fragments[url] for url in
+                    dfh.filter(pl.col("Date").str.starts_with(year))["URL"]
+                ]
+                if grouped:
+                    year_layer(year_fragments).add_to(year_fg)
+                elif tiled:
+                    RouteLayer(
+                        url=write_year_tile(year, year_fragments)
+                    ).add_to(year_fg)
+                else:
+                    RouteLayer(year_fragments).add_to(year_fg)
+            if not grouped:
+                m.get_root().script.add_child(folium.Element(route_layer_js))
+            walks_on_map, aggregate_distance = len(dfh), dfh["Distance"].sum()
+        else:
+            print("\tHikes on map: ", end=" " * 3)
+            for hike in dfh.iter_rows(named=True):
+                year_fg = fg_by_year[hike["Date"][:4]]
+                make_line(hike).add_to(year_fg)
+                walks_on_map += 1
+                print(f"{'\b' * 3}{walks_on_map:>3}", end="", flush=True)
+                aggregate_distance += hike["Distance"]
+            print("")
 
     for yfg in fg_by_year.values():
         yfg.add_to(m)
+    if network:
+        with profile_stage("network"):
+            network_layer(dfh).add_to(
+                folium.FeatureGroup(name="Shared paths", show=False).add_to(m))
     m.add_child(folium.LayerControl(position='topright', collapsed=False, autoZIndex=True))
-
-    map_title = f"(Almost) every hike Chris has organised for Free Outdoor Trips from London"
-    ave_length = aggregate_distance / walks_on_map
-    map_sub_title = (f"{walks_on_map} hikes plotted, average length "
-                     f"{distance_description(ave_length)}")
-    title_html = (f'<h4 style="position:fixed;z-index:100000;bottom:5px;left:20px;background-color:white;" >'
-                  f'{map_title}<br>{map_sub_title}</h4>')
-    m.get_root().html.add_child(folium.Element(title_html))
+    m.get_root().html.add_child(folium.Element(
+        map_title_html(walks_on_map, aggregate_distance)))
 
     map_file = "page\\map.html"
-    m.save(map_file)
+    previous_size = os.path.getsize(map_file) if os.path.exists(map_file) else 0
+    with profile_stage("html save"):
+        m.save(map_file)
+    new_size = os.path.getsize(map_file)
+    print(f"\t{map_file}: {new_size:,} bytes (previously {previous_size:,}"
+          f"{f', {previous_size / new_size:.1f}x reduction' * (previous_size > new_size)})")
     webbrowser.open(
         f"file:///C:/Users/j_a_c/Python%20Stuff/ChrisMap/page/map.html"
     )
 
 
-def build_map():
+def base_map() -> folium.Map:
+    m = folium.Map(location=(51.5, -0.15), tiles=folium.TileLayer("cartodb positron", name="Clear"), zoom_start=9)
+    folium.TileLayer('https://tile.thunderforest.com/transport/{z}/{x}/{y}.png?apikey=a23a350629204ae8b1e22f0729186cb1',
+                     attr='&copy; <a href="http://www.thunderforest.com/">Thunderforest</a>, &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
+                     name="Railways").add_to(m)
+    return m
+
+
+def map_title_html(walks_on_map: int, aggregate_distance: int | float) -> str:
+    map_title = f"(Almost) every hike Chris has organised for Free Outdoor Trips from London"
+    ave_length = aggregate_distance / walks_on_map
+    map_sub_title = (f"{walks_on_map} hikes plotted, average length "
+                     f"{distance_description(ave_length)}")
+    return (f'<h4 style="position:fixed;z-index:100000;bottom:5px;left:20px;background-color:white;" >'
+            f'{map_title}<br>{map_sub_title}</h4>')
+
+
+def build_map(compact: bool = False, tiled: bool = False, lod: bool = False,
+              grouped: bool = False, network: bool = False,
+              batch: bool = False, headless: bool = False):
     """assume existing HikeDetails.csv is correct and only add
-        new hikes, or re-generate .pts files that are outdated"""
-    new_gpx = find_files_in(downloads_path, ".gpx")["filename"].to_list()
+        new hikes, or re-generate .pts files that are outdated.
+        In batch mode, .gpx files that clearly match a new hike are
+        allocated to it without asking (see batch_allocate_gpx_files), and
+        headless mode doesn't ask about the others either"""
+    with profile_stage("gpx discovery"):
+        new_gpx = find_files_in(downloads_path, ".gpx")["filename"].to_list()
     dfh = read_hike_details()
     latest_mapped_date = dfh["Date"].max()
     print(f"\n{latest_mapped_date=}")
-    check_and_update_meetup_events()
-    new_hikes = all_known_hikes().filter(
-                pl.col("Date") > latest_mapped_date
-            )
+    with profile_stage("scraping"):
+        check_and_update_meetup_events()
+    with profile_stage("hike lists"):
+        new_hikes = all_known_hikes().filter(
+                    pl.col("Date") > latest_mapped_date
+                )
     # TODO: make it possible to replace files for older hikes
-    while new_gpx:
-        gpx_file = new_gpx.pop()
-        print(f"Looking at {gpx_file}:")
-        chosen_hike = allocate_gpx_to_hike(gpx_file, new_hikes)
-        if chosen_hike:
-            url, destination_file = chosen_hike
-            hike_date, hike_title, _, url, _ = new_hikes.filter(URL=url).row(0)
-            print(f"Getting data for {hike_title}, {hike_date}")
+    if batch or headless:
+        allocations = batch_allocate_gpx_files(new_gpx[::-1], new_hikes,
+                                               interactive=not headless)
+    else:
+        allocations = interactive_allocations(new_gpx, new_hikes)
+    for url, destination_file in allocations:
+        hike_date, hike_title, _, url, _ = new_hikes.filter(URL=url).row(0)
+        print(f"Getting data for {hike_title}, {hike_date}")
+        with profile_stage("parsing"):
             points = gpxpy_points_from_gpx_file(destination_file)
+        with profile_stage("route store"):
             points_to_file(points, url)
-            df_new = pl.DataFrame(
+        df_new = pl.DataFrame(
+            [
                 [
-                    [
-                        *new_hikes.filter(URL=url).row(0),
-                        destination_file,
-                        *calculate_hike_particulars(points)
-                    ]
-                ],
-                schema=dfh.schema, orient="row"
-            )
-            dfh = pl.concat([dfh, df_new])
+                    *new_hikes.filter(URL=url).row(0),
+                    destination_file,
+                    *calculate_hike_particulars(points)
+                ]
+            ],
+            schema=dfh.schema, orient="row"
+        )
+        dfh = pl.concat([dfh, df_new])
+    with profile_stage("route store"):
+        compact_route_store()
     dfh = fill_blanks_in_hike_details(dfh)
     dfh.write_csv("HikeDetails.csv")
-    dfh.write_csv(f"Previous Hike Details\\{int(arrow.now().timestamp())}.csv")
-    new_map()
+    record_hike_details(dfh)
+    new_map(incremental=True, compact=compact, tiled=tiled, lod=lod,
+            grouped=grouped, network=network)
 
 
-def allocate_gpx_to_hike(file_path: str, df_hikes: pl.DataFrame) -> tuple[str, str] | None:
+def interactive_allocations(new_gpx: [str], df_hikes: pl.DataFrame):
+    while new_gpx:
+        gpx_file = new_gpx.pop()
+        print(f"Looking at {gpx_file}:")
+        chosen_hike = allocate_gpx_to_hike(gpx_file, df_hikes)
+        if chosen_hike:
+            yield chosen_hike
+
+
+def allocate_gpx_to_hike(file_path: str, df_hikes: pl.DataFrame,
+                         gpx_subfolder: str = "") -> tuple[str, str] | None:
     filename = re.sub(r"[\w:]+\\", "", file_path)
-    gpx_subfolder = choose_uploader()
-    new_file_name = f"gpx\\{gpx_subfolder}\\{filename}"
+    gpx_subfolder = gpx_subfolder or choose_uploader()
     hike_options = [
         f"{h_title}, {arrow.get(h_date).format('Do MMM YYYY')}"
         for h_date, h_title, _, _, _ in df_hikes.iter_rows()
@@ -112,28 +347,174 @@ def allocate_gpx_to_hike(file_path: str, df_hikes: pl.DataFrame) -> tuple[str, s
     if choice.isnumeric():
         i_hike = int(choice) - 1
         if i_hike < len(df_hikes):
-            if any(
-                f.startswith(filename[:-4])
-                for f in os.listdir(f"gpx\\{gpx_subfolder}")
-            ):
-                new_file_name = re.sub(
-                    r"\.gpx$",
-                    f"_{int(arrow.now().timestamp())}.gpx",
-                    new_file_name
-                )
-            os.rename(f"{downloads_path}\\{filename}", new_file_name)
-            new_file_name = ensure_correct_date_in_gpx_file(
-                f"gpx\\{gpx_subfolder}",
-                new_file_name.split("\\")[2],
-                df_hikes[i_hike, "Date"]
-            )
+            new_file_name = file_gpx_for_hike(
+                file_path, gpx_subfolder, df_hikes[i_hike, "Date"])
             return df_hikes[i_hike, "URL"], new_file_name
 
 
+def file_gpx_for_hike(file_path: str, gpx_subfolder: str, hike_date: str) -> str:
+    """move a .gpx file from Downloads to the uploader's folder, making
+        sure it has the date of the hike"""
+    filename = re.sub(r"[\w:]+\\", "", file_path)
+    new_file_name = f"gpx\\{gpx_subfolder}\\{filename}"
+    if any(
+        f.startswith(filename[:-4])
+        for f in os.listdir(f"gpx\\{gpx_subfolder}")
+    ):
+        new_file_name = re.sub(
+            r"\.gpx$",
+            f"_{int(arrow.now().timestamp())}.gpx",
+            new_file_name
+        )
+    os.rename(f"{downloads_path}\\{filename}", new_file_name)
+    return ensure_correct_date_in_gpx_file(
+        f"gpx\\{gpx_subfolder}",
+        new_file_name.split("\\")[2],
+        hike_date
+    )
+
+
+def batch_allocate_gpx_files(gpx_files: [str], df_hikes: pl.DataFrame,
+                             interactive: bool = True) -> [(str, str)]:
+    """Allocate each .gpx file that clearly matches one of the hikes to it
+        (see confident_match), filing it in the folder given by the first
+        of the upload rules that matches it.  Other files are offered to
+        the user, best matches first, or if not interactive are left in
+        Downloads, as are files no upload rule matches and files that
+        can't be read"""
+    allocations = []
+    for gpx_file in gpx_files:
+        if df_hikes.is_empty():
+            break
+        filename = re.sub(r"[\w:]+\\", "", gpx_file)
+        try:
+            df_scores = score_gpx_against_hikes(gpx_file, df_hikes)
+            gpx_subfolder = uploader_folder(gpx_file)
+        except (ET.ParseError, gpxpy.gpx.GPXException, AssertionError) as error:
+            print(f"{filename} left in Downloads: can't be read ({error!r})")
+            continue
+        url = confident_match(df_scores)
+        if url and (gpx_subfolder or interactive):
+            hike_date, hike_title = df_hikes.filter(URL=url).row(0)[:2]
+            print(f"{filename}: {hike_title}, {hike_date} "
+                  f"(score {df_scores['Score'][0]})")
+            allocations.append((url, file_gpx_for_hike(
+                gpx_file, gpx_subfolder or choose_uploader(), hike_date)))
+        elif interactive:
+            print(f"Looking at {gpx_file}:")
+            chosen_hike = allocate_gpx_to_hike(
+                gpx_file,
+                df_hikes.join(df_scores, on="URL").sort(
+                    "Score", descending=True, maintain_order=True
+                ).drop("Score"),
+                gpx_subfolder
+            )
+            if chosen_hike:
+                allocations.append(chosen_hike)
+        else:
+            print(f"{filename} left in Downloads: "
+                  f"{'no upload rule' if url else 'no clear match'}")
+        if allocations and allocations[-1][0] in df_hikes["URL"]:
+            df_hikes = df_hikes.filter(pl.col("URL") != allocations[-1][0])
+    return allocations
+
+
+def score_gpx_against_hikes(gpx_file: str, df_hikes: pl.DataFrame) -> pl.DataFrame:
+    """How well a .gpx file matches each hike (URL, Score, best first).
+        Points are scored for its date (4 if it's the day of the hike, 2 if
+        the day either side), for each end of the route being at a station
+        named in the title (1 each) and for its distance being within 15%
+        (2) or 30% (1) of the mileage in the title"""
+    gpx_date = gpx_date_in_file(gpx_file)
+    start, end, distance = calculate_hike_particulars(
+        gpxpy_points_from_gpx_file(gpx_file))
+    miles = distance / 1_609.344
+    stations = [re.sub(r"\s*\(.*\)", "", station).lower()
+                for station in (start, end) if station]
+    scores = []
+    for date, title in df_hikes.select("Date", "Title").iter_rows():
+        score = 0
+        if gpx_date:
+            days_apart = abs((arrow.get(gpx_date) - arrow.get(date)).days)
+            score += {0: 4, 1: 2}.get(days_apart, 0)
+        score += sum(station in title.lower() for station in stations)
+        title_miles = mileages_in_title(title)
+        if title_miles:
+            error = min(abs(miles - m) / m for m in title_miles)
+            score += 2 if error <= 0.15 else 1 if error <= 0.3 else 0
+        scores.append(score)
+    return pl.DataFrame(
+        {"URL": df_hikes["URL"], "Score": scores}
+    ).sort("Score", descending=True, maintain_order=True)
+
+
+def mileages_in_title(title: str) -> [float]:
+    """eg. [8.0, 15.0, 20.0] for 'Bayford Bluebells (8, 15 or 20 miles)',
+        [15.0, 11.0] for 'Cradle - 15 (or 11) miles' or [13.0, 14.0] for
+        'Autumn Colours (13-14 Miles)'"""
+    number = r"\d+(?:\.\d+)?"
+    found = re.search(
+        rf"({number}(?:(?:\s*,\s*|\s*\(?\s*(?:or|to)\s+|-){number}\)?)*)"
+        r"\s*miles\b",
+        title, flags=re.IGNORECASE
+    )
+    return [float(m) for m in re.findall(number, found.group(1))] if found else []
+
+
+def confident_match(df_scores: pl.DataFrame,
+                    min_score: int = 4, min_lead: int = 2) -> str | None:
+    """URL of the best-scoring hike, if it scores at least min_score and
+        is at least min_lead ahead of the next best"""
+    best, *others = df_scores["Score"].to_list()[:2] or [0]
+    if best >= min_score and all(best - other >= min_lead for other in others):
+        return df_scores["URL"][0]
+
+
+def uploader_folder(gpx_file: str) -> str | None:
+    """gpx subfolder given by the first rule in gpx_upload_rules.json
+        that matches the file.  Rules are like
+        {"folder": "07", "creator": "Strava", "filename": "^Afternoon"},
+        where every field other than folder (creator, author or filename)
+        is a regular expression that must be found in that detail"""
+    details = gpx_uploader_details(gpx_file)
+    for rule in upload_rules():
+        if all(re.search(pattern, details.get(field, ""), re.IGNORECASE)
+               for field, pattern in rule.items() if field != "folder"):
+            return rule["folder"]
+
+
+def upload_rules() -> [dict[str, str]]:
+    if os.path.exists(upload_rules_file):
+        with open(upload_rules_file, encoding="utf-8") as rules:
+            return json.load(rules)
+    return []
+
+
+def gpx_uploader_details(gpx_file: str) -> dict[str, str]:
+    """filename, creator and author name, read from the head of a .gpx file"""
+    details = {"filename": re.sub(r"[\w:]+\\", "", gpx_file)}
+    tags = []
+    for event, element in ET.iterparse(gpx_file, events=("start", "end")):
+        tag = element.tag.rpartition("}")[2]
+        if event == "end":
+            tags.pop()
+            if tag == "name" and tags[-1:] == ["author"]:
+                details["author"] = element.text or ""
+            continue
+        if tag in ("trk", "rte", "wpt"):
+            break
+        if tag == "gpx":
+            details["creator"] = element.get("creator", "")
+        tags.append(tag)
+    return details
+
+
 def hike_matching_table() -> pl.DataFrame:
     """Table of all known hikes matched with best known .gpx files
         (= first six columns of HikeDetails.csv)
-        Takes 1.32sec (down from 1.5 since switching to os.scandir())
+        Takes 1.32sec (down from 1.5 since switching to os.scandir()),
+        most of which was reading every .gpx file for its date, which
+        now only happens for files that aren't in the gpx index
         """
     df = all_known_hikes()
     return df.join(
@@ -149,12 +530,15 @@ def hike_matching_table() -> pl.DataFrame:
 def find_files_in(folder: str, file_ext: str) -> pl.DataFrame:
     return pl.DataFrame(
         [
-            (f"{folder}\\{file.name}", file.stat().st_mtime)
+            (f"{folder}\\{file.name}", stats.st_mtime, stats.st_size)
             for file in filter(
-                lambda f: f.name.endswith(file_ext), os.scandir(folder)
+                lambda f: f.name.endswith(file_ext), scan_folder(folder)
             )
+            for stats in [file.stat()]
         ],
-        schema=["filename", "mod_timestamp"], orient="row"
+        schema={"filename": pl.String, "mod_timestamp": pl.Float64,
+                "size": pl.Int64},
+        orient="row"
     )
 
 
@@ -162,7 +546,8 @@ def find_all_gpx_files(include_plans: bool = False) -> pl.DataFrame:
     max_sf = max(
         map(
             int,
-            filter(lambda folder: folder.isnumeric(), os.listdir("gpx"))
+            filter(lambda folder: folder.isnumeric(),
+                   (f.name for f in scan_folder("gpx")))
             )
     )
     df_gpx = pl.concat(
@@ -172,18 +557,76 @@ def find_all_gpx_files(include_plans: bool = False) -> pl.DataFrame:
                         [downloads_path] + (["gpx\\plans"] * include_plans)
         ]
     )
-    return df_gpx.select(
-        Date=pl.Series(
-            [
-                gpx_date_in_file(file)
-                for file in df_gpx["filename"]
-            ]
-        ),
+    return gpx_index(df_gpx).select(
+        "Date",
         GPX=pl.col("filename"),
         ts=pl.col("mod_timestamp")
     )
 
 
+def gpx_index(df_files: pl.DataFrame) -> pl.DataFrame:
+    """Date, point count and bounding box of each .gpx file listed in
+        df_files (as returned by find_files_in), in the same order.
+        These are kept in a persistent index in the cache folder, and a
+        file is only read again if its mtime or size has changed.  Files
+        indexed before but not in df_files keep their entries, as long as
+        the files still exist"""
+    df_known = (pl.read_parquet(gpx_index_file)
+                if os.path.exists(gpx_index_file)
+                else pl.DataFrame(schema=gpx_index_schema))
+    df = df_files.with_row_index("order").join(
+        df_known, on=["filename", "mod_timestamp", "size"], how="left"
+    )
+    stale = df.filter(pl.col("points").is_null())["filename"]
+    profile_counts["gpx files indexed"] += len(stale)
+    if len(stale):
+        df = df.update(
+            pl.DataFrame(
+                [{"filename": file, **gpx_metadata(file)} for file in stale],
+                schema={"filename": pl.String,
+                        **{k: v for k, v in gpx_index_schema.items()
+                           if k not in df_files.columns}}
+            ),
+            on="filename"
+        )
+    df_others = df_known.filter(
+        ~pl.col("filename").is_in(df_files["filename"].to_list())
+    )
+    df_kept = df_others.filter(
+        pl.Series([os.path.exists(file) for file in df_others["filename"]],
+                  dtype=pl.Boolean)
+    )
+    if len(stale) or len(df_kept) < len(df_others):
+        os.makedirs(cache_folder, exist_ok=True)
+        pl.concat([
+            df.select(gpx_index_schema.keys()), df_kept
+        ]).write_parquet(f"{gpx_index_file}.tmp")
+        os.replace(f"{gpx_index_file}.tmp", gpx_index_file)
+    return df.sort("order").drop("order")
+
+
+def gpx_metadata(file_path: str) -> dict:
+    """Date, point count and bounding box of one .gpx file.  Files whose
+        points can't be read are indexed with no points and no bounding box"""
+    metadata = {"Date": gpx_date_in_file(file_path), "points": 0}
+    try:
+        df = gpx_points_frame(file_path)
+    except (AssertionError, gpxpy.gpx.GPXException):
+        return metadata
+    metadata["points"] = len(df)
+    for coord in ("latitude", "longitude"):
+        metadata[f"min_{coord}"] = df[coord].min()
+        metadata[f"max_{coord}"] = df[coord].max()
+    return metadata
+
+
+def scan_folder(folder: str) -> [os.DirEntry]:
+    """list the contents of a folder, counting how often each folder
+        is scanned for the --profile report"""
+    profile_counts[f"scans of {folder}"] += 1
+    return [*os.scandir(folder)]
+
+
 def choose_uploader() -> str:
     subfolders = gpx_folders_key.gpx_folders
     sf_key = input(
@@ -227,33 +670,702 @@ def show_options_list(numbered_choices: list[str]) -> str:
 
 
 def calculate_hike_particulars(route: [geo.Location]) -> tuple[str, str, int]:
-    start, end = (
-        find_proximate_station(route[i_pt])
-        for i_pt in (0, -1)
-    )
-    distance = get_total_distance(route)
+    with profile_stage("station lookup"):
+        start, end = nearest_stations(
+            *zip(*((route[i_pt].latitude, route[i_pt].longitude)
+                   for i_pt in (0, -1)))
+        )
+    with profile_stage("distance"):
+        distance = get_total_distance(route)
     return start, end, distance
 
 
 def make_line(hike_data: dict) -> folium.GeoJson:
     """create GeoJson feature for the route to be added to the map"""
     points = points_from_file(hike_data["URL"], longitude_first=True)
-    date = arrow.get(hike_data["Date"])
-    tooltip = (f"{date.format('ddd Do MMM YYYY')}<br/>"
-               f"{hike_data['Title']}<br/>"
-               f"{route_description(hike_data)}<br/>"
-               f"{distance_description(hike_data['Distance'])}")
     gj = geojson.FeatureCollection([geojson.LineString(points)])
     return folium.GeoJson(
         gj,
-        style_function=lambda feature:
-        {"color": "blue", "opacity": 0.3, "weight": 8},
-        highlight_function=lambda feature:
-        {"color": "red", "opacity": 1.0, "weight": 3},
-        tooltip=tooltip
+        style_function=lambda feature: route_style,
+        highlight_function=lambda feature: route_highlight,
+        tooltip=hike_tooltip(hike_data)
+    )
+
+
+def year_layer(fragments: [str]) -> folium.GeoJson:
+    """one folium.GeoJson for a year's routes (see route_fragment), with one
+        style and one tooltip (from each route's properties) shared by all"""
+    return folium.GeoJson(
+        geojson.FeatureCollection([json.loads(f) for f in fragments]),
+        style_function=lambda feature: route_style,
+        highlight_function=lambda feature: route_highlight,
+        tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False)
+    )
+
+
+def hike_tooltip(hike_data: dict) -> str:
+    date = arrow.get(hike_data["Date"])
+    return (f"{date.format('ddd Do MMM YYYY')}<br/>"
+            f"{hike_data['Title']}<br/>"
+            f"{route_description(hike_data)}<br/>"
+            f"{distance_description(hike_data['Distance'])}")
+
+
+def route_fragments(
+        dfh: pl.DataFrame, compact: bool = False, lod: bool = False
+) -> dict[str, str]:
+    """url -> GeoJSON Feature (as JSON text) for every hike in dfh.
+        Fragments are cached in fragment_folder, keyed on a hash of the
+        hike's HikeDetails row and route points, so only hikes that are
+        new or have changed since the last build are rendered again"""
+    keys_file = f"{fragment_folder}\\keys.json"
+    os.makedirs(fragment_folder, exist_ok=True)
+    cached_keys = {}
+    if os.path.exists(keys_file):
+        with open(keys_file, encoding="utf-8") as kf:
+            cached_keys = json.load(kf)
+    fragments, keys, rendered = {}, {}, 0
+    for hike in dfh.iter_rows(named=True):
+        url = hike["URL"]
+        df_route = route_frame(url)
+        keys[url] = hashlib.sha1(
+            json.dumps([hike, compact, lod], sort_keys=True).encode() +
+            b"".join(np.ascontiguousarray(df_route[c].to_numpy()).tobytes()
+                     for c in ("lat", "long"))
+        ).hexdigest()
+        fragment_file = f"{fragment_folder}\\{url}.json"
+        if cached_keys.get(url) == keys[url] and os.path.exists(fragment_file):
+            with open(fragment_file, encoding="utf-8") as ff:
+                fragments[url] = ff.read()
+        else:
+            fragments[url] = route_fragment(hike, df_route, compact, lod)
+            with open(fragment_file, "w", encoding="utf-8") as ff:
+                ff.write(fragments[url])
+            rendered += 1
+    print(f"\tRoutes rendered: {rendered} (of {len(keys)} hikes on map)")
+    with open(keys_file, "w", encoding="utf-8") as kf:
+        json.dump(keys, kf)
+    return fragments
+
+
+def route_fragment(
+        hike_data: dict, df_route: pl.DataFrame,
+        compact: bool = False, lod: bool = False
+) -> str:
+    properties = {"tooltip": hike_tooltip(hike_data)}
+    if lod:
+        properties["levels"] = detail_levels(
+            df_route["significance"] if "significance" in df_route.columns
+            else route_significance(df_route["lat"], df_route["long"])
+        )
+    if compact:
+        feature = geojson.Feature(
+            geometry=None,
+            properties=properties | {
+                "polyline": encode_polyline(df_route["lat"], df_route["long"])
+            }
+        )
+    else:
+        feature = geojson.Feature(
+            geometry=geojson.LineString(
+                [*zip(df_route["long"].to_list(), df_route["lat"].to_list())]
+            ),
+            properties=properties
+        )
+    return json.dumps(feature).replace("</", "<\\/")
+
+
+def detail_levels(significance) -> str:
+    """for each point, as a string of digits, the first of lod_levels
+        (counting from 0) at which the point is drawn"""
+    tolerances = np.array([metres for _, metres in lod_levels])
+    levels = (np.asarray(significance)[:, None] < tolerances).sum(axis=1)
+    return (levels + ord("0")).astype(np.uint8).tobytes().decode("ascii")
+
+
+def route_significance(latitudes, longitudes) -> np.ndarray:
+    """Douglas-Peucker significance of each point of a route, in metres:
+        the largest simplification tolerance at which the point would be
+        kept.  The ends are always kept (inf).  Points that would go at
+        significance_floor are left at 0 rather than refined further"""
+    lat, long = (np.asarray(a, dtype=np.float64)
+                 for a in (latitudes, longitudes))
+    significance = np.zeros(len(lat), dtype=np.float32)
+    if not len(lat):
+        return significance
+    significance[[0, -1]] = np.inf
+    x = long * np.cos(np.radians(lat.mean())) * geo.ONE_DEGREE
+    y = lat * geo.ONE_DEGREE
+    segments = [(0, len(lat) - 1, np.inf)]
+    while segments:
+        first, last, ceiling = segments.pop()
+        if last - first < 2:
+            continue
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        along = np.clip((px * dx + py * dy) / (dx * dx + dy * dy), 0, 1) if (
+            dx or dy) else 0
+        offsets = np.hypot(px - along * dx, py - along * dy)
+        i_max = offsets.argmax()
+        if offsets[i_max] < significance_floor:
+            continue
+        keep = first + 1 + i_max
+        significance[keep] = min(offsets[i_max], ceiling)
+        segments += [(first, keep, significance[keep]),
+                     (keep, last, significance[keep])]
+    return significance
+
+
+def encode_polyline(latitudes, longitudes,
+                    precision: int = polyline_precision) -> str:
+    """Google encoded-polyline text for a route: coordinates rounded to
+        precision decimal places, delta-encoded and packed five bits to
+        a printable character"""
+    values = np.round(
+        np.column_stack([latitudes, longitudes]) * 10 ** precision
+    ).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=[[0, 0]]).ravel()
+    zigzag = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    position = np.arange(7)
+    shifted = zigzag[:, None] >> (5 * position)
+    lengths = np.maximum(1, (shifted > 0).sum(axis=1))[:, None]
+    chunks = (shifted & 0x1f) | np.where(position < lengths - 1, 0x20, 0)
+    return (chunks[position < lengths] + 63).astype(np.uint8).tobytes(
+    ).decode("ascii")
+
+
+def write_year_tile(year: str, fragments: [str]) -> str:
+    """write a year's route fragments as a JSON array next to map.html,
+        returning its url relative to the page"""
+    os.makedirs(f"page\\{year_tiles_folder}", exist_ok=True)
+    with open(f"page\\{year_tiles_folder}\\{year}.json", "w",
+              encoding="utf-8") as tile:
+        tile.write(f"[\n{',\n'.join(fragments)}\n]")
+    return f"{year_tiles_folder}/{year}.json"
+
+
+def route_network(cell_metres: int = network_cell_metres) -> pl.DataFrame:
+    """Every route in the route store snapped to a grid of cell_metres
+        squares and broken into edges between neighbouring cells, so that
+        routes along the same path share edges.  One row per edge (grid
+        row and column of each end, lower end first) with the URLs of the
+        hikes that use it.  Cached until the route store changes"""
+    return cached_frame(
+        f"route_network_{cell_metres}",
+        mtimes_key(*filter(os.path.exists,
+                           (route_store_file, route_stage_file))) +
+        f"@{network_latitude():.6f}",
+        lambda: grid_edges(read_route_store(), cell_metres,
+                           network_latitude()).group_by(
+            "row_a", "col_a", "row_b", "col_b"
+        ).agg(
+            pl.col("URL").sort()
+        ).sort("row_a", "col_a", "row_b", "col_b")
+    )
+
+
+def grid_edges(df_routes: pl.DataFrame, cell_metres: int,
+               latitude: float) -> pl.DataFrame:
+    """(URL, row_a, col_a, row_b, col_b) for each grid edge that each route
+        in a (URL, lat, long) table crosses.  Where consecutive points are
+        more than one cell apart the cells between them are filled in, so
+        that each edge joins two cells that touch (sides or corners)"""
+    cell_lat, cell_long = grid_cell_size(cell_metres, latitude)
+    rows = np.floor(df_routes["lat"].to_numpy() / cell_lat).astype(np.int64)
+    cols = np.floor(df_routes["long"].to_numpy() / cell_long).astype(np.int64)
+    urls = df_routes["URL"].to_numpy()
+    d_row, d_col = np.diff(rows), np.diff(cols)
+    steps = np.where(urls[1:] == urls[:-1],
+                     np.maximum(np.abs(d_row), np.abs(d_col)), 0)
+    segment = np.repeat(np.arange(len(steps)), steps)
+    step = np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)
+    ends = [
+        (rows[segment] + np.round(d_row[segment] * fraction).astype(np.int64),
+         cols[segment] + np.round(d_col[segment] * fraction).astype(np.int64))
+        for fraction in (step / steps[segment], (step + 1) / steps[segment])
+    ]
+    (row_from, col_from), (row_to, col_to) = ends
+    swap = (row_from > row_to) | ((row_from == row_to) & (col_from > col_to))
+    return pl.DataFrame(
+        {
+            "URL": urls[1:][segment].astype(str),
+            "row_a": np.where(swap, row_to, row_from),
+            "col_a": np.where(swap, col_to, col_from),
+            "row_b": np.where(swap, row_from, row_to),
+            "col_b": np.where(swap, col_from, col_to),
+        },
+        schema={"URL": pl.String, "row_a": pl.Int64, "col_a": pl.Int64,
+                "row_b": pl.Int64, "col_b": pl.Int64}
+    ).unique(maintain_order=True)
+
+
+def grid_cell_size(cell_metres: int, latitude: float) -> tuple[float, float]:
+    """(degrees of latitude, degrees of longitude) of a grid cell, with
+        longitudes scaled for the given latitude"""
+    cell_lat = cell_metres / geo.ONE_DEGREE
+    return cell_lat, cell_lat / math.cos(math.radians(latitude))
+
+
+def network_latitude() -> float:
+    """mean latitude of the routes in the route store, which the grid of
+        route_network is scaled for"""
+    return read_route_store()["lat"].mean() or 0.0
+
+
+def hikes_on_path(points: [(float, float)], min_share: float = 0.8,
+                  cell_metres: int = network_cell_metres) -> [str]:
+    """URLs of the hikes whose routes cover at least min_share of a path
+        (given as (latitude, longitude) points), most of the path first.
+        For a single point, the hikes that pass within its grid cell"""
+    lats, longs = zip(*points)
+    latitude = network_latitude()
+    df_path = grid_edges(
+        pl.DataFrame({"URL": "path", "lat": lats, "long": longs}), cell_metres,
+        latitude)
+    df_network = route_network(cell_metres).explode("URL")
+    if df_path.is_empty():
+        cell_lat, cell_long = grid_cell_size(cell_metres, latitude)
+        row, col = int(lats[0] // cell_lat), int(longs[0] // cell_long)
+        return df_network.filter(
+            ((pl.col("row_a") == row) & (pl.col("col_a") == col)) |
+            ((pl.col("row_b") == row) & (pl.col("col_b") == col))
+        )["URL"].unique().sort().to_list()
+    return df_network.join(
+        df_path.drop("URL"), on=["row_a", "col_a", "row_b", "col_b"]
+    ).group_by("URL").len().filter(
+        pl.col("len") >= min_share * len(df_path)
+    ).sort(["len", "URL"], descending=[True, False])["URL"].to_list()
+
+
+def network_layer(dfh: pl.DataFrame,
+                  cell_metres: int = network_cell_metres) -> folium.GeoJson:
+    """The paths taken by the hikes in dfh, each drawn once however many
+        hikes used it.  Runs of edges used by the same hikes are joined into
+        one line, drawn thicker the more hikes used it, whose tooltip
+        lists them"""
+    titles = {url: f"{arrow.get(date).format('D MMM YYYY')} {title}"
+              for date, title, url in dfh.select("Date", "Title", "URL").iter_rows()}
+    cell_lat, cell_long = grid_cell_size(cell_metres, network_latitude())
+    features = []
+    for urls, df_edges in route_network(cell_metres).with_columns(
+            pl.col("URL").list.filter(pl.element().is_in([*titles]))
+    ).filter(pl.col("URL").list.len() > 0).group_by(
+        pl.col("URL").list.join(" "), maintain_order=True
+    ):
+        urls = urls[0].split()
+        lines = chain_edges(
+            ((a_row, a_col), (b_row, b_col)) for a_row, a_col, b_row, b_col
+            in df_edges.select("row_a", "col_a", "row_b", "col_b").iter_rows()
+        )
+        hike_list = "<br/>".join(titles[url] for url in urls[:8])
+        cells = np.array([cell for line in lines for cell in line]) + 0.5
+        coordinates = np.round(
+            np.column_stack((cells[:, 1] * cell_long, cells[:, 0] * cell_lat)), 6)
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "MultiLineString",
+                "coordinates": [
+                    line.tolist() for line in np.split(
+                        coordinates, np.cumsum([len(ln) for ln in lines])[:-1])
+                ]
+            },
+            "properties": {
+                "weight": 2 + 2 * math.log2(len(urls)),
+                "tooltip": f"{len(urls)} hike{'s' * (len(urls) > 1)}:<br/>"
+                           f"{hike_list}"
+                           f"{f'<br/>and {len(urls) - 8} more' * (len(urls) > 8)}"
+            }
+        })
+    return folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        style_function=lambda feature: route_style | {
+            "weight": feature["properties"]["weight"], "opacity": 0.6},
+        highlight_function=lambda feature: route_highlight,
+        tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False)
     )
 
 
+def chain_edges(edges) -> [[tuple]]:
+    """join (node, node) edges into as few lines (lists of nodes) as
+        possible without passing through a junction"""
+    neighbours = collections.defaultdict(list)
+    for a, b in edges:
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+    drawn = set()
+
+    def follow(node, next_node) -> [tuple]:
+        line = [node]
+        while (node, next_node) not in drawn:
+            drawn.update({(node, next_node), (next_node, node)})
+            line.append(next_node)
+            if len(neighbours[next_node]) != 2:
+                break
+            node, next_node = next_node, next(
+                n for n in neighbours[next_node] if n != node)
+        return line
+
+    lines = [follow(node, next_node)
+             for node in sorted(neighbours) if len(neighbours[node]) != 2
+             for next_node in neighbours[node] if (node, next_node) not in drawn]
+    lines += [follow(node, next_node)       # loops, with no ends
+              for node in sorted(neighbours)
+              for next_node in neighbours[node] if (node, next_node) not in drawn]
+    return lines
+
+
+def export_vector_tiles(min_zoom: int = vector_tile_zooms[0],
+                        max_zoom: int = vector_tile_zooms[1]):
+    """Write every hike's route as Mapbox vector tiles, with one layer
+        ("hikes") carrying each hike's date, title, distance, start and end.
+        The tiles go into the MBTiles archive vector_tiles_archive, and to
+        page\\tiles\\<z>\\<x>\\<y>.pbf for GitHub Pages, where
+        page\\tile_map.html fetches only the tiles in view.  At each zoom
+        level routes are simplified to about a pixel (see
+        route_significance) and clipped to each tile.  Routes still only in
+        legacy .pts files are included"""
+    print("Building vector tiles:")
+    dfh = read_hike_details()
+    hike_properties = {
+        url: {"date": date, "title": title,
+              "distance": None if distance is None else int(distance),
+              "start": start, "end": end}
+        for date, title, url, distance, start, end in dfh.select(
+            "Date", "Title", "URL", "Distance", "Start", "End").iter_rows()
+    }
+    df_routes = tile_routes([*hike_properties])
+    if df_routes.is_empty():
+        print("\tNo hike routes to make vector tiles of")
+        return
+    bounds = [df_routes["long"].min(), df_routes["lat"].min(),
+              df_routes["long"].max(), df_routes["lat"].max()]
+    tile_folder = f"page\\{vector_tiles_folder}"
+    shutil.rmtree(tile_folder, ignore_errors=True)
+    archive = f"{vector_tiles_archive}.tmp"
+    with contextlib.closing(mbtiles_database(archive, {
+        "name": "hikes", "format": "pbf", "type": "overlay",
+        "minzoom": min_zoom, "maxzoom": max_zoom,
+        "bounds": ",".join(f"{b:.6f}" for b in bounds),
+        "center": f"{(bounds[0] + bounds[2]) / 2:.6f},"
+                  f"{(bounds[1] + bounds[3]) / 2:.6f},{min_zoom}",
+        "json": json.dumps({"vector_layers": [{
+            "id": "hikes", "minzoom": min_zoom, "maxzoom": max_zoom,
+            "fields": {"date": "String", "title": "String",
+                       "distance": "Number", "start": "String",
+                       "end": "String"}
+        }]}),
+    })) as db:
+        for zoom in range(min_zoom, max_zoom + 1):
+            with profile_stage(f"vector tiles z{zoom}"):
+                tiles = vector_tiles(df_routes, hike_properties, zoom)
+                db.executemany(
+                    "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                    ((zoom, x, 2 ** zoom - 1 - y, gzip.compress(data))
+                     for (x, y), data in tiles.items())
+                )
+                for (x, y), data in tiles.items():
+                    os.makedirs(f"{tile_folder}\\{zoom}\\{x}", exist_ok=True)
+                    with open(f"{tile_folder}\\{zoom}\\{x}\\{y}.pbf",
+                              "wb") as tile_file:
+                        tile_file.write(data)
+            print(f"\tzoom {zoom}: {len(tiles):,} tiles, "
+                  f"{sum(map(len, tiles.values())):,} bytes")
+        db.commit()
+    os.replace(archive, vector_tiles_archive)
+    tile_map(dfh, min_zoom, max_zoom).save(vector_tiles_page)
+    print(f"\t{vector_tiles_archive}, {vector_tiles_page}")
+
+
+def tile_map(dfh: pl.DataFrame, min_zoom: int, max_zoom: int) -> folium.Map:
+    """the map for the vector tiles written by export_vector_tiles, shown
+        on click of a route as the hike's details"""
+    m = base_map()
+    tiles = VectorGridProtobuf(
+        f"{vector_tiles_folder}/{{z}}/{{x}}/{{y}}.pbf", "Hikes",
+        {"vectorTileLayerStyles": {"hikes": route_style},
+         "interactive": True, "minNativeZoom": min_zoom,
+         "maxNativeZoom": max_zoom}
+    ).add_to(m)
+    tiles.add_child(TileLayerPopups())
+    m.add_child(folium.LayerControl(position='topright', collapsed=False))
+    m.get_root().html.add_child(folium.Element(
+        map_title_html(len(dfh), dfh["Distance"].sum())))
+    return m
+
+
+def vector_tiles(df_routes: pl.DataFrame, hike_properties: dict[str, dict],
+                 zoom: int) -> dict[tuple[int, int], bytes]:
+    """(x, y) -> encoded vector tile for every tile at the zoom level that
+        the routes in a (URL, lat, long, significance) table pass through.
+        Each hike is one feature of the tile, with the properties given"""
+    df_parts = tile_parts(df_routes, zoom)
+    tiles = {}
+    for (x, y), df_tile in df_parts.partition_by(
+            "tile_x", "tile_y", as_dict=True, maintain_order=True).items():
+        parts = df_tile["part"].to_numpy()
+        starts = np.flatnonzero(np.diff(parts, prepend=-1))
+        urls = df_tile["URL"].gather(starts).to_list()
+        lines = np.split(df_tile.select("x", "y").to_numpy(), starts[1:])
+        tiles[x, y] = encode_vector_tile([
+            (hike_properties[url], [line for _, line in url_lines])
+            for url, url_lines in itertools.groupby(
+                zip(urls, lines), key=lambda url_line: url_line[0])
+        ])
+    return tiles
+
+
+def tile_routes(urls: [str]) -> pl.DataFrame:
+    """(URL, lat, long, significance) table of the routes of the given
+        hikes, from the route store or, failing that, their .pts files"""
+    df_store = read_route_store().filter(pl.col("URL").is_in(urls))
+    legacy = [
+        route_frame(url).select("lat", "long").with_columns(URL=pl.lit(url))
+        for url in urls
+        if known_routes().get(url, route_store_file) != route_store_file
+    ]
+    if not legacy:
+        return df_store
+    df_legacy = with_significance(pl.concat(legacy).select("URL", "lat", "long"))
+    return pl.concat([df_store, df_legacy.select(df_store.columns)],
+                     how="vertical_relaxed")
+
+
+def tile_parts(df_routes: pl.DataFrame, zoom: int) -> pl.DataFrame:
+    """The routes in a (URL, lat, long, significance) table simplified for
+        the zoom level and cut into the pieces that fall in each tile
+        (plus vector_tile_buffer): one row per point, with its tile, URL,
+        piece (numbered in order) and position in tile units.  A route keeps
+        the points significant at the size of a pixel at its mean latitude.
+        Each route segment is clipped to each tile it may cross
+        (Liang-Barsky), all segments at once"""
+    if "significance" not in df_routes.columns:
+        df_routes = with_significance(df_routes)
+    df_kept = df_routes.filter(
+        pl.col("significance")
+        >= 2 * math.pi * geo.EARTH_RADIUS / (256 << zoom)
+        * pl.col("lat").mean().over("URL").radians().cos()
+    )
+    scale = vector_tile_extent << zoom
+    lat = np.radians(df_kept["lat"].to_numpy())
+    px = (df_kept["long"].to_numpy() + 180) / 360 * scale
+    py = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * scale
+    urls = df_kept["URL"].to_numpy()
+    segment = np.flatnonzero(urls[1:] == urls[:-1])
+    x0, y0, dx, dy = (px[segment], py[segment],
+                      px[segment + 1] - px[segment], py[segment + 1] - py[segment])
+
+    # every (segment, tile) pair, for the tiles around each segment's box
+    first_x, last_x, first_y, last_y = (
+        np.floor((edge + shift) / vector_tile_extent).astype(np.int64)
+        for edge, shift in ((np.minimum(x0, x0 + dx), -vector_tile_buffer),
+                            (np.maximum(x0, x0 + dx), vector_tile_buffer),
+                            (np.minimum(y0, y0 + dy), -vector_tile_buffer),
+                            (np.maximum(y0, y0 + dy), vector_tile_buffer)))
+    columns, rows = last_x - first_x + 1, last_y - first_y + 1
+    pair = np.repeat(np.arange(len(segment)), columns * rows)
+    offset = np.arange(len(pair)) - np.repeat(
+        np.cumsum(columns * rows) - columns * rows, columns * rows)
+    tile_x = first_x[pair] + offset % columns[pair]
+    tile_y = first_y[pair] + offset // columns[pair]
+    order = np.lexsort((pair, tile_y, tile_x))
+    pair, tile_x, tile_y = pair[order], tile_x[order], tile_y[order]
+
+    # clip each segment to its tile: t0, t1 are how far along it enters, leaves
+    t0, t1 = np.zeros(len(pair)), np.ones(len(pair))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in (
+                (-dx[pair], x0[pair] - tile_x * vector_tile_extent + vector_tile_buffer),
+                (dx[pair], (tile_x + 1) * vector_tile_extent + vector_tile_buffer - x0[pair]),
+                (-dy[pair], y0[pair] - tile_y * vector_tile_extent + vector_tile_buffer),
+                (dy[pair], (tile_y + 1) * vector_tile_extent + vector_tile_buffer - y0[pair])):
+            ratio = q / p
+            t0 = np.where(p < 0, np.maximum(t0, ratio), t0)
+            t1 = np.where(p > 0, np.minimum(t1, ratio), t1)
+            t1 = np.where((p == 0) & (q < 0), -1, t1)
+    inside = t0 <= t1
+    pair, tile_x, tile_y, t0, t1 = (a[inside] for a in (pair, tile_x, tile_y, t0, t1))
+
+    # a piece continues until the tile changes, or a segment is cut short
+    new_part = np.ones(len(pair), dtype=bool)
+    new_part[1:] = ((tile_x[1:] != tile_x[:-1]) | (tile_y[1:] != tile_y[:-1]) |
+                    (segment[pair[1:]] != segment[pair[:-1]] + 1) |
+                    (t1[:-1] < 1) | (t0[1:] > 0))
+    part = np.cumsum(new_part) - 1
+    last_in_part = np.append(new_part[1:], True)
+    ends = np.concatenate([np.arange(len(pair)), np.flatnonzero(last_in_part)])
+    along = np.concatenate([t0, t1[last_in_part]])
+    order = np.argsort(ends * 2 + (np.arange(len(ends)) >= len(pair)), kind="stable")
+    ends, along = ends[order], along[order]
+    seg = pair[ends]
+    df_points = pl.DataFrame({
+        "tile_x": tile_x[ends], "tile_y": tile_y[ends],
+        "URL": urls[segment[seg]].astype(str), "part": part[ends],
+        "x": np.round(x0[seg] + along * dx[seg]
+                      - tile_x[ends] * vector_tile_extent).astype(np.int64),
+        "y": np.round(y0[seg] + along * dy[seg]
+                      - tile_y[ends] * vector_tile_extent).astype(np.int64),
+    }, schema={"tile_x": pl.Int64, "tile_y": pl.Int64, "URL": pl.String,
+               "part": pl.Int64, "x": pl.Int64, "y": pl.Int64})
+    # drop points that round to the one before, then pieces left as a point
+    return df_points.filter(
+        (pl.col("part") != pl.col("part").shift()) |
+        (pl.col("x") != pl.col("x").shift()) | (pl.col("y") != pl.col("y").shift())
+        | pl.col("part").shift().is_null()
+    ).filter(pl.len().over("part") > 1)
+
+
+def encode_vector_tile(features: [(dict, [np.ndarray])],
+                       layer: str = "hikes") -> bytes:
+    """A Mapbox vector tile (protobuf, version 2 of the spec) with one layer
+        of line features, each given as (properties, lines), where each line
+        is an array of integer (x, y) positions within the tile extent.
+        Properties that are None are left out"""
+    keys, values, encoded = {}, {}, []
+    for feature_id, (properties, lines) in enumerate(features, start=1):
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags += [keys.setdefault(key, len(keys)),
+                     values.setdefault((type(value), value), len(values))]
+        points = np.concatenate(lines)
+        deltas = np.diff(points, axis=0, prepend=[[0, 0]])
+        zigzag = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+        geometry, first = [], 0
+        for line in lines:      # MoveTo the first point, LineTo the rest
+            geometry += [[1 << 3 | 1], zigzag[first],
+                         [(len(line) - 1) << 3 | 2],
+                         zigzag[first + 1:first + len(line)].ravel()]
+            first += len(line)
+        encoded.append(protobuf_field(
+            2,
+            protobuf_field(1, feature_id) +
+            protobuf_field(2, b"".join(map(protobuf_varint, tags))) +
+            protobuf_field(3, 2) +      # LINESTRING
+            protobuf_field(4, protobuf_varints(np.concatenate(geometry)))
+        ))
+    return protobuf_field(3, b"".join([
+        protobuf_field(15, 2),
+        protobuf_field(1, layer),
+        *encoded,
+        *(protobuf_field(3, key) for key in keys),
+        *(protobuf_field(4, protobuf_field(1, value) if value_type is str
+                         else protobuf_field(5, value))
+          for value_type, value in values),
+        protobuf_field(5, vector_tile_extent),
+    ]))
+
+
+def protobuf_field(number: int, value: int | str | bytes) -> bytes:
+    """a protobuf field: an int as a varint, text or bytes length-delimited"""
+    if isinstance(value, int):
+        return protobuf_varint(number << 3) + protobuf_varint(value)
+    if isinstance(value, str):
+        value = value.encode()
+    return protobuf_varint(number << 3 | 2) + protobuf_varint(len(value)) + value
+
+
+def protobuf_varint(value: int) -> bytes:
+    """a non-negative int as a protobuf varint: seven bits to a byte, least
+        significant first, with the top bit set on all but the last byte"""
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def protobuf_varints(values) -> bytes:
+    """protobuf_varint of each of an array of ints, all at once"""
+    values = np.asarray(values, dtype=np.int64)
+    position = np.arange(9)
+    shifted = values[:, None] >> (7 * position)
+    lengths = np.maximum(1, (shifted > 0).sum(axis=1))[:, None]
+    chunks = (shifted & 0x7f) | np.where(position < lengths - 1, 0x80, 0)
+    return chunks[position < lengths].astype(np.uint8).tobytes()
+
+
+def mbtiles_database(filename: str, metadata: dict) -> sqlite3.Connection:
+    """a new MBTiles (1.3) database at filename, with no tiles yet"""
+    if os.path.exists(filename):
+        os.remove(filename)
+    db = sqlite3.connect(filename)
+    db.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    db.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, "
+               "tile_row INTEGER, tile_data BLOB)")
+    db.execute("CREATE UNIQUE INDEX tile_index "
+               "ON tiles (zoom_level, tile_column, tile_row)")
+    db.executemany("INSERT INTO metadata VALUES (?, ?)",
+                   [(name, str(value)) for name, value in metadata.items()])
+    return db
+
+
+class RouteLayer(folium.MacroElement):
+    """One L.geoJson layer drawing all the supplied route fragments, using
+        the shared style and tooltip handling in route_layer_js.  Given a
+        url instead, the fragments are fetched from there when the parent
+        layer is first shown"""
+    def __init__(self, fragments: [str] = (), url: str = ""):
+        super().__init__()
+        self._name = "RouteLayer"
+        self.fragments = fragments
+        self.url = url
+
+    def render(self, **kwargs):
+        parent = self._parent.get_name()
+        if self.url:
+            script = f'lazyRouteLayer({parent}, "{self.url}");'
+        else:
+            features = ",\n".join(self.fragments)
+            script = (f'L.geoJson(routeFeatures([\n{features}\n]), '
+                      f'routeLayerOptions()).addTo({parent});')
+        self.get_root().script.add_child(
+            ScriptText(script), name=self.get_name()
+        )
+
+
+class TileLayerPopups(folium.MacroElement):
+    """On click of a route in the parent vector tile layer, a popup
+        with the hike's details (from its properties in the tile, which
+        may lack a start, end or distance)"""
+    def __init__(self):
+        super().__init__()
+        self._name = "TileLayerPopups"
+
+    def render(self, **kwargs):
+        parent = self._parent.get_name()
+        script = f"""{parent}.on("click", function (e) {{
+    var hike = e.layer.properties;
+    var route = hike.start === undefined || hike.end === undefined
+        ? hike.start || hike.end
+        : hike.start == hike.end ? "Circular walk from " + hike.start
+                                 : hike.start + " to " + hike.end;
+    var distance = hike.distance === undefined ? "" :
+        (hike.distance / 1609).toFixed(1) + " miles / " +
+        (hike.distance / 1000).toFixed(1) + " km";
+    L.popup().setLatLng(e.latlng)
+        .setContent([hike.date, hike.title, route, distance]
+                    .filter(Boolean).join("<br/>"))
+        .openOn({parent}._map);
+}});"""
+        self.get_root().script.add_child(
+            ScriptText(script), name=self.get_name()
+        )
+
+
+class ScriptText(folium.Element):
+    """Element whose text goes into the page verbatim.  (A plain
+        folium.Element compiles its text as a Jinja template, which
+        takes seconds for a page's worth of route data)"""
+    _template = Template("{{ this.text }}")
+
+    def __init__(self, text: str):
+        super().__init__()
+        self.text = text
+
+
 def distance_description(distance_metres: int | float) -> str:
     dist_mls, dist_kms = (distance_metres / factor
                           for factor in (1_609, 1_000))
@@ -267,29 +1379,157 @@ def route_description(data: dict) -> str:
     return f"{start} to {end}"
 
 
-def rebuild_hike_details() -> pl.DataFrame:
-    """from scratch"""
+def rebuild_hike_details(workers: int = 0) -> pl.DataFrame:
+    """from scratch.  Given a number of workers, the .gpx files themselves
+        are re-processed, in that many processes in parallel, rather than
+        the stored routes"""
     dfh = hike_matching_table().drop_nulls("GPX")
-    dfp = pl.DataFrame(
-        [calculate_hike_particulars(
-            [geo.Location(*pt) for pt in points_from_file(u)])
-            for u in dfh["URL"]],
-        schema=["Start", "End", "Distance"], orient="row"
-    )
+    if workers:
+        dfp = particulars_in_parallel(dfh["GPX"], workers)
+    else:
+        routes = [points_from_file(u) for u in dfh["URL"]]
+        ends = [route[i_pt] for route in routes for i_pt in (0, -1)]
+        lats = [lat for lat, _ in ends]
+        longs = [long for _, long in ends]
+        stations = nearest_stations(lats, longs)
+        dfp = pl.DataFrame(
+            {
+                "Start": stations[::2],
+                "End": stations[1::2],
+                "Distance": [route_distances(*zip(*route))[0]
+                             for route in routes],
+            }
+        )
     dfh = pl.concat([dfh, dfp], how="horizontal")
     return fill_blanks_in_hike_details(dfh)
 
 
+def particulars_in_parallel(gpx_files: [str], workers: int) -> pl.DataFrame:
+    """Start, End and Distance for each .gpx file (in the same order),
+        worked out by a pool of processes.  Prints the time spent on
+        each stage, summed over all the files"""
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        results = [*executor.map(gpx_particulars, gpx_files, chunksize=4)]
+    stage_times = collections.Counter()
+    for *_, timings in results:
+        stage_times.update(timings)
+    print(f"\tProcessed {len(results)} gpx files with {workers} workers:")
+    for stage, seconds in stage_times.items():
+        print(f"\t\t{stage}: {seconds:.2f}sec")
+    return pl.DataFrame(
+        [particulars for *particulars, _ in results],
+        schema=["Start", "End", "Distance"], orient="row"
+    )
+
+
+def gpx_particulars(gpx_file: str) -> tuple[str, str, int, dict[str, float]]:
+    """Start, End and Distance for a .gpx file, as they would be worked
+        out when adding it to the map, plus seconds taken by each stage"""
+    timings, lap_start = {}, time.perf_counter()
+
+    def lap(stage: str):
+        nonlocal lap_start
+        now = time.perf_counter()
+        timings[stage], lap_start = now - lap_start, now
+
+    df = gpx_points_frame(gpx_file)
+    lap("parse")
+    df = reduce_route(df)
+    lap("reduce points")
+    distance, _ = route_distances(df["latitude"], df["longitude"])
+    lap("distance")
+    start, end = nearest_stations(
+        df["latitude"].gather([0, -1]), df["longitude"].gather([0, -1])
+    )
+    lap("stations")
+    return start, end, distance, timings
+
+
 def read_hike_details(filename: str = "HikeDetails.csv") -> pl.DataFrame:
+    """The current hike details, or a previous version (<timestamp>.csv),
+        either from a legacy full copy or reconstructed from the history"""
     if filename != "HikeDetails.csv":
-        filename = f"Previous Hike Details\\{filename}"
+        legacy_file = f"{history_folder}\\{filename}"
+        if not os.path.exists(legacy_file):
+            return hike_details_at(int(filename.removesuffix(".csv")))
+        filename = legacy_file
     return pl.read_csv(filename, schema_overrides={"URL": pl.String})
 
 
+def record_hike_details(dfh: pl.DataFrame, timestamp: int = 0):
+    """Add a version of the hike details to the history.  Each distinct row
+        is stored once, in rows.csv with a hash of its contents, and each
+        version is a line of versions.csv listing its rows' hashes in order.
+        Nothing is recorded if dfh is the same as the latest version"""
+    timestamp = timestamp or int(arrow.now().timestamp())
+    hashes = row_hashes(dfh)
+    versions = history_versions()
+    if versions and [*versions.values()][-1] == hashes:
+        return
+    rows_file, versions_file = (f"{history_folder}\\{name}.csv"
+                                for name in ("rows", "versions"))
+    known_rows = pl.read_csv(
+        rows_file, columns=["Row"]
+    )["Row"].to_list() if os.path.exists(rows_file) else []
+    append_csv(
+        rows_file,
+        dfh.select(
+            Row=pl.Series(hashes), *dfh.columns
+        ).filter(
+            ~pl.col("Row").is_in(known_rows)
+        ).unique("Row", keep="first", maintain_order=True)
+    )
+    append_csv(
+        versions_file,
+        pl.DataFrame({"Timestamp": [timestamp], "Rows": [" ".join(hashes)]})
+    )
+
+
+def row_hashes(df: pl.DataFrame) -> [str]:
+    return [
+        hashlib.sha1(json.dumps(row, default=str).encode()).hexdigest()[:16]
+        for row in df.iter_rows()
+    ]
+
+
+def append_csv(file: str, df: pl.DataFrame):
+    if os.path.exists(file):
+        with open(file, "a", encoding="utf-8") as csv_file:
+            csv_file.write(df.write_csv(include_header=False))
+    else:
+        replace_file(file, df.write_csv().encode())
+
+
+def history_versions() -> dict[int, [str]]:
+    """timestamp -> hashes of the rows of each recorded version, oldest first"""
+    versions_file = f"{history_folder}\\versions.csv"
+    if not os.path.exists(versions_file):
+        return {}
+    return {
+        timestamp: rows.split()
+        for timestamp, rows in pl.read_csv(
+            versions_file, schema={"Timestamp": pl.Int64, "Rows": pl.String}
+        ).iter_rows()
+    }
+
+
+def hike_details_at(timestamp: int) -> pl.DataFrame:
+    df_rows = pl.read_csv(
+        f"{history_folder}\\rows.csv", infer_schema_length=None,
+        schema_overrides={"Row": pl.String, "URL": pl.String}
+    )
+    return pl.DataFrame(
+        {"Row": history_versions()[timestamp]}
+    ).with_row_index("order").join(
+        df_rows, on="Row", how="left"
+    ).sort("order").drop("order", "Row")
+
+
 def fill_blanks_in_hike_details(df_in: pl.DataFrame) -> pl.DataFrame:
-    df_manual = pl.read_ods(
-        "ManualStartEnd.ods", schema_overrides={"URL": pl.String}
-    ).select("URL", "Start", "End")
+    df_manual = manual_start_end().select("URL", "Start", "End")
     df_out = df_in.join(df_manual, how="left", on="URL")
     return df_out.with_columns(
         Start=pl.col("Start").fill_null(pl.col("Start_right")),
@@ -297,87 +1537,436 @@ def fill_blanks_in_hike_details(df_in: pl.DataFrame) -> pl.DataFrame:
     ).select(pl.exclude("Start_right", "End_right"))
 
 
+def manual_start_end() -> pl.DataFrame:
+    return ods_frame("ManualStartEnd.ods", URL=pl.String)
+
+
+def manually_added_hikes() -> pl.DataFrame:
+    return ods_frame("ManuallyAddedHikes.ods", Date=pl.String, URL=pl.String)
+
+
+def ods_frame(ods_file: str, **schema_overrides) -> pl.DataFrame:
+    """A spreadsheet of manual overrides, mirrored in the binary cache and
+        only read again when the .ods file's mtime changes.  Each version
+        is loaded once per run"""
+    return cached_ods_frame(ods_file, mtimes_key(ods_file),
+                            tuple(schema_overrides.items()))
+
+
+@functools.cache
+def cached_ods_frame(ods_file: str, key: str,
+                     schema_overrides: ((str, pl.DataType),)) -> pl.DataFrame:
+    return cached_frame(
+        ods_file.removesuffix(".ods"), key,
+        lambda: pl.read_ods(ods_file, schema_overrides=dict(schema_overrides))
+    )
+
+
 def gpxpy_points_from_gpx_file(filepath: str) -> [geo.Location]:
     """Read in a route as list of points ready to be used
         for calculations for the map"""
     print(f"\tParsing gpx file: {filepath} . . .")
+    return [
+        geo.Location(*pt) for pt in reduce_route(
+            gpx_points_frame(filepath)
+        ).select("latitude", "longitude", "elevation").iter_rows()
+    ]
+
+
+def gpx_points_frame(filepath: str) -> pl.DataFrame:
+    """All the track points in a .gpx file, as a DataFrame of latitude,
+        longitude, elevation and time.  The file is streamed through
+        an XML parser, without building an object for every point.
+        Anything other than a single track segment is left to gpxpy"""
+    columns = {"latitude": [], "longitude": [], "elevation": [], "time": []}
+    segments = 0
+    try:
+        for _, element in ET.iterparse(filepath):
+            tag = element.tag.rpartition("}")[2]
+            if tag == "trkpt":
+                columns["latitude"].append(float(element.get("lat")))
+                columns["longitude"].append(float(element.get("lon")))
+                details = {child.tag.rpartition("}")[2]: child.text
+                           for child in element}
+                columns["elevation"].append(
+                    float(details["ele"]) if details.get("ele") else None
+                )
+                columns["time"].append(details.get("time"))
+                element.clear()
+            elif tag == "trkseg":
+                segments += 1
+    except ET.ParseError:
+        segments = 0
+    if segments != 1 or not columns["latitude"]:
+        return gpxpy_points_frame(filepath)
+    return pl.DataFrame(
+        columns,
+        schema={"latitude": pl.Float64, "longitude": pl.Float64,
+                "elevation": pl.Float64, "time": pl.String}
+    ).with_columns(
+        pl.col("time").str.strip_chars().str.to_datetime(
+            time_zone="UTC", strict=False)
+    )
+
+
+def gpxpy_points_frame(filepath: str) -> pl.DataFrame:
     with open(filepath, encoding="utf-8") as gpx_file:
         gpx = gpxpy.parse(gpx_file)
-    no_of_points = len(gpx.tracks[0].segments[0].points)
-    if no_of_points > 8_000:
-        no_of_points = no_of_points // 10
-    gpx.reduce_points(max_points_no=no_of_points)
     assert len(gpx.tracks) == 1
     assert len(gpx.tracks[0].segments) == 1
-    return gpx.tracks[0].segments[0].points
+    points = gpx.tracks[0].segments[0].points
+    return pl.DataFrame(
+        {
+            prop: [pt.__getattribute__(prop) for pt in points]
+            for prop in ("latitude", "longitude", "elevation", "time")
+        },
+        schema={"latitude": pl.Float64, "longitude": pl.Float64,
+                "elevation": pl.Float64, "time": pl.Datetime("us", "UTC")}
+    )
+
+
+def reduce_route(df_points: pl.DataFrame) -> pl.DataFrame:
+    """Thin out the points of routes over 8,000 points long to a tenth
+        as many, exactly as gpxpy's reduce_points has always done it:
+        keep each point at least (length / target points) metres, in 3D,
+        from the last one kept"""
+    no_of_points = len(df_points)
+    if no_of_points <= 8_000:
+        return df_points
+    points = [*zip(*(df_points[c].to_list()
+                     for c in ("latitude", "longitude", "elevation")))]
+    length = 0
+    for previous, point in zip(points, points[1:]):
+        length += geo.distance(*point, *previous) or 0
+    min_distance = max(0, math.ceil(length / (no_of_points // 10)))
+    keep, last_kept = [0], points[0]
+    for i, point in enumerate(points[1:], start=1):
+        if geo.distance(*last_kept, *point) >= min_distance:
+            keep.append(i)
+            last_kept = point
+    return df_points[keep]
 
 
 def points_from_file(url: str, longitude_first: bool = False) -> [(float,)]:
-    """read from specified points file (url, no extension)
-        to list of tuple (lat, long), or empty list if
-        file doesn't exist"""
-    points_file = f"{url}.pts"
-    if points_file in os.listdir("routes"):
-        df_pts = pl.read_csv(f"routes\\{url}.pts")
-        if longitude_first:
-            df_pts = df_pts.select("long", "lat")
-        return [*df_pts.iter_rows()]
-    return []
+    """read the points for the specified route (url) from the route store,
+        or failing that from its legacy .pts file, to list of tuple
+        (lat, long), or empty list if the route doesn't exist"""
+    df_pts = route_frame(url).select("lat", "long")
+    if df_pts.is_empty():
+        return []
+    if longitude_first:
+        df_pts = df_pts.select("long", "lat")
+    return [*zip(*(df_pts[c].to_list() for c in df_pts.columns))]
+
+
+def route_frame(url: str) -> pl.DataFrame:
+    """(lat, long[, significance]) DataFrame of the points for the route
+        (url), empty if there is no such route"""
+    profile_counts["route lookups"] += 1
+    source = known_routes().get(url)
+    if source == route_store_file:
+        return read_route_store().slice(
+            *route_offsets()[url]
+        ).select(pl.exclude("URL"))
+    if source:
+        return pl.read_csv(source)
+    return pl.DataFrame(schema={"lat": pl.Float64, "long": pl.Float64})
 
 
 def points_to_file(points: [geo.Location], filename_stem: str):
-    """save a list of gpxpy points to file (no extension).
-        Overwrites any existing file with the same name"""
-    folder, filename = "routes", f"{filename_stem}.pts"
-    pl.DataFrame(
+    """save a list of gpxpy points to the route store under the given
+        name.  Overwrites any existing route with the same name"""
+    save_routes(
+        {
+            filename_stem: pl.DataFrame(
+                {
+                    "lat": [pt.latitude for pt in points],
+                    "long": [pt.longitude for pt in points]
+                }
+            )
+        }
+    )
+
+
+@functools.cache
+def known_routes() -> dict[str, str]:
+    """url -> file holding its points, for every route in the route store
+        or in a legacy .pts file.  Built once per run (one scan of the
+        routes folder) and shared by everything that looks up routes"""
+    routes = {
+        f.name[:-4]: f"routes\\{f.name}"
+        for f in scan_folder("routes") if f.name.endswith(".pts")
+    }
+    routes.update(dict.fromkeys(route_offsets(), route_store_file))
+    return routes
+
+
+@functools.cache
+def read_route_store() -> pl.DataFrame:
+    """Every stored route in one long (URL, lat, long, significance)
+        table, memory-mapped from the Arrow IPC file in a single load,
+        followed by any routes staged since it was last compacted.
+        Each route's points are contiguous, in order (see route_offsets)"""
+    if os.path.exists(route_store_file):
+        return with_staged_routes(pl.read_ipc(route_store_file))
+    return with_staged_routes(empty_route_store())
+
+
+def empty_route_store() -> pl.DataFrame:
+    return pl.DataFrame(
+        schema={"URL": pl.String, "lat": pl.Float64, "long": pl.Float64,
+                "significance": pl.Float32}
+    )
+
+
+def staged_routes() -> pl.DataFrame:
+    """the routes in route_stage_file, read into memory (so that it can be
+        replaced), see save_routes"""
+    if os.path.exists(route_stage_file):
+        with open(route_stage_file, "rb") as stage:
+            return pl.read_ipc(stage.read())
+    return empty_route_store()
+
+
+def with_staged_routes(df_store: pl.DataFrame) -> pl.DataFrame:
+    """the staged routes added to the end of df_store, in place of any
+        routes stored under the same urls"""
+    df_staged = staged_routes()
+    if df_staged.is_empty():
+        return df_store
+    replaced = df_store["URL"].is_in(df_staged["URL"].unique().to_list())
+    if replaced.any():
+        df_store = df_store.filter(~replaced)
+    return pl.concat([df_store, df_staged.select(df_store.columns)])
+
+
+@functools.cache
+def route_offsets() -> dict[str, tuple[int, int]]:
+    """url -> (first row, number of rows) of that route in the route store"""
+    return {
+        url: (first_row, length)
+        for url, first_row, length in read_route_store().with_row_index(
+        ).group_by("URL", maintain_order=True).agg(
+            pl.col("index").first(), pl.len()
+        ).iter_rows()
+    }
+
+
+def save_routes(routes: dict[str, pl.DataFrame]):
+    """Add routes (url -> DataFrame of lat, long) to the end of the route
+        store, replacing any already stored under the same urls.  They are
+        staged in route_stage_file, which only holds the routes saved since
+        the store was last compacted, so that saving a route costs the
+        size of those rather than of the whole store.  The build then
+        merges them into the store in one write (compact_route_store)"""
+    df_staged = pl.concat(
+        [staged_routes().filter(~pl.col("URL").is_in([*routes]))] +
+        [
+            with_significance(
+                df.select(URL=pl.lit(url), lat=pl.col("lat").cast(pl.Float64),
+                          long=pl.col("long").cast(pl.Float64))
+            )
+            for url, df in routes.items()
+        ]
+    )
+    df_staged.write_ipc(f"{route_stage_file}.tmp", compression="uncompressed")
+    clear_route_caches()
+    os.replace(f"{route_stage_file}.tmp", route_stage_file)
+
+
+def compact_route_store():
+    """merge the staged routes into the route store file"""
+    if os.path.exists(route_stage_file):
+        write_route_store(unmapped_route_store())
+
+
+def with_significance(df_routes: pl.DataFrame) -> pl.DataFrame:
+    """add the significance of each point (see route_significance)
+        to a (URL, lat, long) table of routes"""
+    return df_routes.with_columns(
+        significance=pl.concat(
+            [
+                pl.Series(route_significance(df["lat"], df["long"]))
+                for df in df_routes.partition_by("URL", maintain_order=True)
+            ] or [pl.Series([], dtype=pl.Float32)]
+        )
+    )
+
+
+def delete_routes(urls: [str]):
+    write_route_store(
+        unmapped_route_store().filter(~pl.col("URL").is_in([*urls]))
+    )
+
+
+def unmapped_route_store() -> pl.DataFrame:
+    """copy of the route store (with any staged routes) held in memory, so
+        that the file itself can be replaced (not possible on Windows while
+        it is mapped)"""
+    df_store = empty_route_store()
+    if os.path.exists(route_store_file):
+        with open(route_store_file, "rb") as store:
+            df_store = pl.read_ipc(store.read())
+    return with_staged_routes(df_store)
+
+
+def write_route_store(df_store: pl.DataFrame):
+    """replace the route store file with df_store, which includes any
+        staged routes, so the stage is emptied"""
+    if "significance" not in df_store.columns:
+        df_store = with_significance(df_store)
+    temp_file = f"{route_store_file}.tmp"
+    df_store.write_ipc(temp_file, compression="uncompressed")
+    clear_route_caches()
+    os.replace(temp_file, route_store_file)
+    if os.path.exists(route_stage_file):
+        os.remove(route_stage_file)
+
+
+def clear_route_caches():
+    read_route_store.cache_clear()
+    route_offsets.cache_clear()
+    known_routes.cache_clear()
+
+
+def migrate_points_files():
+    """Copy every legacy .pts file in routes into the route store (one
+        write).  The .pts files are left in place but no longer read"""
+    pts_files = [f.name for f in scan_folder("routes")
+                 if f.name.endswith(".pts")]
+    print(f"Migrating {len(pts_files)} .pts files to {route_store_file}")
+    save_routes(
         {
-            "lat": [pt.latitude for pt in points],
-            "long": [pt.longitude for pt in points]
+            pts_file[:-4]: pl.read_csv(f"routes\\{pts_file}")
+            for pts_file in pts_files
         }
-    ).write_csv(f"{folder}\\{filename}")
+    )
+    compact_route_store()
 
 
 def get_total_distance(route: [geo.Location]) -> int:
     """for given route, cumulatively sum the distance between each point
         to get the length of the route in metres"""
-    distance = 0
-    last_pt = route[0]
-    for i, pt in enumerate(route[1:]):
-        distance += pt.distance_2d(last_pt)
-        last_pt = pt
-    return int(distance)
-
-
-def find_proximate_station(location: geo.Location) -> str | None:
-    tolerance_degrees = 0.05    # equates to <= 5km either side
-    # TODO: rewrite this using gpxpy method?
-    #       - it produces results that can be different to old method
-
-    def ib_args(lat_or_long: str) -> ():
-        return (
-                location.__getattribute__(f"{lat_or_long}itude") +
-                (n * tolerance_degrees)
-                for n in (-1, 1)
-        )
-    stn_subset = df_stations.filter(
-        pl.col("latitude").is_between(*ib_args("lat")),
-        pl.col("longitude").is_between(*ib_args("long"))
-    ).with_columns(
-        distance=((pl.col("latitude") - location.latitude) ** 2 +
-                  (pl.col("longitude") - location.longitude) ** 2) ** 0.5
+    distance, _ = route_distances(
+        [pt.latitude for pt in route], [pt.longitude for pt in route]
+    )
+    return distance
+
+
+def route_distances(latitudes, longitudes) -> tuple[int, np.ndarray]:
+    """Length of a route in metres, plus the cumulative distance to each
+        point, from arrays of latitudes and longitudes (e.g. the columns
+        of a .pts file or a gpx DataFrame).  Uses the same formulae as
+        gpxpy's distance_2d (equirectangular for neighbouring points,
+        haversine where they are over 0.2 degrees apart), so totals agree
+        with the old point-by-point loop to within 1 metre"""
+    lat, long = (np.asarray(a, dtype=np.float64)
+                 for a in (latitudes, longitudes))
+    lat_1, long_1, lat_2, long_2 = lat[1:], long[1:], lat[:-1], long[:-1]
+    d_lat = lat_1 - lat_2
+    d_long = (long_1 - long_2) * np.cos(np.radians(lat_1))
+    legs = np.where(
+        (np.abs(lat_1 - lat_2) > 0.2) | (np.abs(long_1 - long_2) > 0.2),
+        haversine_distances(lat_1, long_1, lat_2, long_2),
+        np.sqrt(d_lat * d_lat + d_long * d_long) * geo.ONE_DEGREE
+    )
+    cumulative = np.concatenate(([0.0], np.cumsum(legs)))
+    return int(cumulative[-1]), cumulative
+
+
+def haversine_distances(lat_1, long_1, lat_2, long_2) -> np.ndarray:
+    """element-wise great-circle distances in metres (broadcasts like numpy)"""
+    lat_1, long_1, lat_2, long_2 = (
+        np.radians(np.asarray(a, dtype=np.float64))
+        for a in (lat_1, long_1, lat_2, long_2)
+    )
+    a = (np.sin((lat_1 - lat_2) / 2) ** 2 +
+         np.sin((long_1 - long_2) / 2) ** 2 * np.cos(lat_1) * np.cos(lat_2))
+    return 2 * geo.EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def find_proximate_station(
+        location: geo.Location, radius_metres: int = 5_000
+) -> str | None:
+    return nearest_stations(
+        [location.latitude], [location.longitude], radius_metres
+    )[0]
+
+
+def nearest_stations(
+        latitudes, longitudes, radius_metres: int = 5_000
+) -> [str | None]:
+    """For each (latitude, longitude) point, the name of the closest station
+        by great-circle distance, or None if there isn't one within
+        radius_metres.  Resolve all the points needed in a single call"""
+    index = station_index()
+    cell_lat, cell_long = index["cell_size"]
+    rings = int(np.ceil(radius_metres / index["cell_metres"])) + 1
+    neighbourhood = [(dr, dc)
+                     for dr in range(-rings, rings + 1)
+                     for dc in range(-rings, rings + 1)]
+    names = []
+    for lat, long in zip(latitudes, longitudes):
+        row, col = int(lat // cell_lat), int(long // cell_long)
+        candidates = [index["cells"][cell]
+                      for cell in ((row + dr, col + dc)
+                                   for dr, dc in neighbourhood)
+                      if cell in index["cells"]]
+        name = None
+        if candidates:
+            candidates = np.concatenate(candidates)
+            distances = haversine_distances(
+                lat, long,
+                index["latitude"][candidates], index["longitude"][candidates]
+            )
+            nearest = distances.argmin()
+            if distances[nearest] <= radius_metres:
+                name = index["names"][candidates[nearest]]
+        names.append(name)
+    return names
+
+
+@functools.cache
+def station_index(cell_metres: int = 2_000) -> dict:
+    """Grid-bucket index of the station table: stations are grouped into
+        cells at least cell_metres across so that a nearest-station query
+        only has to measure distances to the handful in neighbouring cells"""
+    df = stations_df().drop_nulls(["latitude", "longitude"])
+    lat, long = (df[c].to_numpy() for c in ("latitude", "longitude"))
+    cell_lat = cell_metres / geo.ONE_DEGREE
+    cell_long = cell_lat / np.cos(np.radians(np.abs(lat).max()))
+    cells = {}
+    for i, cell in enumerate(zip((lat // cell_lat).astype(int).tolist(),
+                                 (long // cell_long).astype(int).tolist())):
+        cells.setdefault(cell, []).append(i)
+    return {
+        "names": df["station_name"].to_list(),
+        "latitude": lat,
+        "longitude": long,
+        "cell_metres": cell_metres,
+        "cell_size": (cell_lat, cell_long),
+        "cells": {cell: np.array(rows) for cell, rows in cells.items()},
+    }
+
+
+@functools.cache
+def stations_df() -> pl.DataFrame:
+    """Station table, loaded on first use.  Comes from the binary cache
+        unless either of the source .csv files has changed since then"""
+    return cached_frame(
+        "stations", mtimes_key(*station_files), build_stations_df
     )
-    if not stn_subset.is_empty():
-        return stn_subset.sort(by="distance")["station_name"].item(0)
 
 
 def build_stations_df() -> pl.DataFrame:
+    mainline_file, tube_file = station_files
     df_mainline = pl.read_csv(
-        "uk-train-stations.csv", columns=[1, 2, 3]
+        mainline_file, columns=[1, 2, 3]
     ).with_columns(
         pl.col("station_name").str.replace(" Rail Station", "")
     )
     df_tube = pl.read_csv(
-        "Stations 20180921.csv", columns=[2, 8, 9]
+        tube_file, columns=[2, 8, 9]
     ).rename(
         {old: new
          for old, new in zip(["NAME", "y", "x"], df_mainline.columns)}
@@ -385,6 +1974,130 @@ def build_stations_df() -> pl.DataFrame:
     return pl.concat([df_mainline, df_tube])
 
 
+def cached_frame(name: str, key: str, build_function) -> pl.DataFrame:
+    """Load a DataFrame from the binary (Parquet) cache if it was saved
+        there with the same key, otherwise build it and cache it"""
+    cache_file, key_file = (f"{cache_folder}\\{name}.{ext}"
+                            for ext in ("parquet", "key"))
+    if os.path.exists(cache_file) and os.path.exists(key_file):
+        with open(key_file, encoding="utf-8") as kf:
+            if kf.read() == key:
+                return pl.read_parquet(cache_file)
+    df = build_function()
+    os.makedirs(cache_folder, exist_ok=True)
+    if os.path.exists(key_file):
+        os.remove(key_file)
+    df.write_parquet(cache_file)
+    with open(key_file, "w", encoding="utf-8") as kf:
+        kf.write(key)
+    return df
+
+
+def mtimes_key(*files: str) -> str:
+    return ",".join(f"{file}:{os.stat(file).st_mtime_ns}" for file in files)
+
+
+@contextlib.contextmanager
+def profile_stage(stage: str):
+    """When profiling, add the time taken by the code in the with block to
+        that stage's total, and note the peak memory (traced by tracemalloc
+        and the process's peak RSS) while it ran"""
+    if not profiling:
+        yield
+        return
+    if stage_peaks:
+        stage_peaks[-1] = max(stage_peaks[-1], tracemalloc.get_traced_memory()[1])
+    stage_peaks.append(0)
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak = max(stage_peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if stage_peaks:
+            stage_peaks[-1] = max(stage_peaks[-1], peak)
+        profile = stage_profiles.setdefault(
+            stage, {"calls": 0, "seconds": 0.0,
+                    "peak_traced_bytes": 0, "peak_rss_bytes": 0}
+        )
+        profile["calls"] += 1
+        profile["seconds"] += seconds
+        profile["peak_traced_bytes"] = max(profile["peak_traced_bytes"], peak)
+        profile["peak_rss_bytes"] = max(profile["peak_rss_bytes"], peak_rss())
+
+
+def start_profiling():
+    global profiling
+    profiling = True
+    tracemalloc.start()
+
+
+def peak_rss() -> int:
+    """the most memory this process has had resident so far, in bytes"""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD),
+                        ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters), counters.cb
+        )
+        return counters.PeakWorkingSetSize
+    import resource
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def print_profile_report(operation: str = ""):
+    print("Profile:")
+    for item, count in sorted(profile_counts.items()):
+        print(f"\t{item}: {count}")
+    print(f"\t(without the route index, each route lookup "
+          f"would have been a scan of routes: "
+          f"{profile_counts['route lookups']} scans)")
+    if not stage_profiles:
+        return
+    print(f"\t{'Stage':<16}{'Calls':>7}{'Seconds':>10}"
+          f"{'Peak traced MB':>16}{'Peak RSS MB':>13}")
+    for stage, profile in stage_profiles.items():
+        print(f"\t{stage:<16}{profile['calls']:>7}{profile['seconds']:>10.3f}"
+              f"{profile['peak_traced_bytes'] / 2 ** 20:>16.1f}"
+              f"{profile['peak_rss_bytes'] / 2 ** 20:>13.1f}")
+    write_profile_report(operation)
+
+
+def write_profile_report(operation: str = ""):
+    """Add this run's stage profile to the list of runs in
+        page\\build_profile.json, to follow trends from one build to the next"""
+    runs = []
+    if os.path.exists(profile_report_file):
+        with open(profile_report_file, encoding="utf-8") as report:
+            runs = json.load(report)
+    runs.append({
+        "time": arrow.now().isoformat(),
+        "operation": operation,
+        "stages": stage_profiles,
+        "counts": dict(profile_counts),
+    })
+    os.makedirs(os.path.dirname(profile_report_file) or ".", exist_ok=True)
+    replace_file(profile_report_file, json.dumps(runs, indent=1).encode())
+
+
 def all_known_hikes() -> pl.DataFrame:
     df_hist = all_historic_hikes()
     df_scraped = hikes_from_subsequent_scrapes()
@@ -393,16 +2106,22 @@ def all_known_hikes() -> pl.DataFrame:
 
 def all_historic_hikes() -> pl.DataFrame:
     df_historic_scrape = hikes_from_original_meetup_scrape()
-    df_man = pl.read_ods(
-        "ManuallyAddedHikes.ods",
-        schema_overrides={"Date": pl.String, "URL": pl.String}
-    )
+    df_man = manually_added_hikes()
     return pl.concat([df_historic_scrape, df_man])
 
 
 def hikes_from_original_meetup_scrape() -> pl.DataFrame:
     """Load all hikes captured by the selenium scrape of the Past Events page
         on 11th March 2024 (going back to first ever hike on 13th January 2019)"""
+    with open("Hikes.txt", "rb") as file:
+        key = hashlib.sha1(file.read()).hexdigest()
+    return cached_frame("original_meetup_scrape", key,
+                        parse_original_meetup_scrape)
+
+
+def parse_original_meetup_scrape() -> pl.DataFrame:
+    """Each pattern is matched over the whole text just once, and each date
+        is paired with the first match of the other patterns at or after it"""
     with open("Hikes.txt", "r") as file:
         text = file.read()
     queries = {
@@ -411,17 +2130,26 @@ def hikes_from_original_meetup_scrape() -> pl.DataFrame:
         "Attendees": r"\d+ attendees,",
         "URL": r"\d{9}"
     }
+    matches = {k: [*re.finditer(q, text)] for k, q in queries.items()}
+    starts = {k: [m.start() for m in found] for k, found in matches.items()}
+
+    def first_match_from(key: str, position: int) -> str:
+        i_match = bisect.bisect_left(starts[key], position)
+        if i_match and matches[key][i_match - 1].end() > position:
+            # a match straddling this position hides any that start within it
+            return re.compile(queries[key]).search(text, position).group()
+        return matches[key][i_match].group()
+
     data = []
     shift_dates = [arrow.Arrow(2022, 11, 4), arrow.Arrow(2023, 10, 27)]
-    for walk in re.finditer(queries["Date"], text):
+    for walk in matches["Date"]:
         date = arrow.get(walk.group()[5:], "MMM D, YYYY")
         if arrow.get(date) in shift_dates:
             date = arrow.get(date).shift(days=1)
         date = date.format("YYYY-MM-DD")
-        sub_text = text[walk.start():]
         title, attendees, url = (
-            re.search(q, sub_text).group()
-            for k, q in queries.items()
+            first_match_from(k, walk.start())
+            for k in queries.keys()
             if k != "Date"
         )
         title = title.split("\n")[1]
@@ -435,67 +2163,241 @@ def hikes_from_original_meetup_scrape() -> pl.DataFrame:
 
 
 def hikes_from_subsequent_scrapes() -> pl.DataFrame:
-    scraped_file = "ScrapedHikes.csv"
-    if scraped_file in os.listdir():
+    if os.path.exists(scraped_hikes_file):
         return pl.read_csv(
-            scraped_file,
+            scraped_hikes_file,
             schema_overrides={"Date": pl.String, "URL": pl.String}
         )
     return pl.DataFrame({})
 
 
 def gpx_date_in_file(file_path: str) -> str:
+    """Date of the first <time> tag in a .gpx file, which is in the header
+        of the files this project writes.  The file is read a chunk at a
+        time, and only as far as that tag"""
+    tag = "<time>"
     with open(f"{file_path}", encoding="utf-8") as gf:
-        gpx_text = gf.read()
-        found_time = re.search("<time>.+</time>", gpx_text)
-        if found_time:
-            return found_time.group()[6:16]
-
-
-def check_and_update_meetup_events():
-    df_new = scrape_past_events_for_chris_hikes().sort(by="Date")
-    scraped_file = "ScrapedHikes.csv"
-    if scraped_file in os.listdir():
-        df_existing = pl.read_csv(scraped_file, schema_overrides={"URL": str})
-        existing_urls = df_existing["URL"].to_list()
-        df_to_add = df_new.filter(~pl.col("URL").is_in(existing_urls))
-        if not df_to_add.is_empty():
-            pl.concat([df_existing, df_to_add]).write_csv(scraped_file)
-    else:
-        df_new.write_csv(scraped_file)
-
-
-def scrape_past_events_for_chris_hikes() -> pl.DataFrame:
-    url = "https://www.meetup.com/free-outdoor-trips-from-london/events/?type=past"
-    response = requests.get(url)
-    html = response.text
-    event_details = []
+        gpx_text = ""
+        while chunk := gf.read(8_192):
+            gpx_text = gpx_text[-(len(tag) + 10):] + chunk
+            found_time = re.search(f"{tag}.{{10}}", gpx_text)
+            if found_time:
+                return found_time.group()[6:16]
+
+
+def check_and_update_meetup_events(pages: int = 1):
+    df_new = scrape_past_events_for_chris_hikes(
+        pages, known_urls=scraped_urls()).sort(by="Date")
+    append_scraped_hikes(df_new)
+
+
+def append_scraped_hikes(df_new: pl.DataFrame) -> int:
+    """Add the hikes whose URLs aren't already in ScrapedHikes.csv to the
+        end of it, returning how many were added.  The new rows go to a
+        journal first, so that an interrupted append is completed (or a
+        partly written row cut off) by recover_scraped_hikes"""
+    if not os.path.exists(scraped_hikes_file):
+        replace_file(scraped_hikes_file, df_new.write_csv().encode())
+        return len(df_new)
+    df_to_add = df_new.filter(
+        ~pl.col("URL").is_in(scraped_urls())
+    ).unique("URL", keep="first", maintain_order=True)
+    if df_to_add.is_empty():
+        return 0
+    with open(scraped_hikes_file, "rb") as file:
+        columns = file.readline().decode("utf-8").strip().split(",")
+        size = file.seek(0, os.SEEK_END)
+        file.seek(max(size - 1, 0))
+        separator = "" if file.read(1) in (b"\n", b"") else "\n"
+    rows = separator + df_to_add.select(columns).write_csv(include_header=False)
+    replace_file(f"{scraped_hikes_file}.journal",
+                 json.dumps({"size": size, "rows": rows}).encode())
+    recover_scraped_hikes()
+    index_file = f"{cache_folder}\\{scraped_hikes_file}.urls"
+    with open(index_file, "a", encoding="utf-8") as index:
+        index.writelines(f"{url}\n" for url in df_to_add["URL"])
+    replace_file(f"{index_file}.key", file_key(scraped_hikes_file).encode())
+    return len(df_to_add)
+
+
+def recover_scraped_hikes():
+    """Complete an append to ScrapedHikes.csv from its journal, if there
+        is one.  The rows are written from where the file ended before the
+        append, so this can safely be repeated"""
+    journal_file = f"{scraped_hikes_file}.journal"
+    if not os.path.exists(journal_file):
+        return
+    with open(journal_file, encoding="utf-8") as jf:
+        journal = json.load(jf)
+    with open(scraped_hikes_file, "r+b") as file:
+        file.seek(journal["size"])
+        file.write(journal["rows"].encode("utf-8"))
+        file.truncate()
+        file.flush()
+        os.fsync(file.fileno())
+    os.remove(journal_file)
+
+
+def scraped_urls() -> {str}:
+    """URLs of all the hikes in ScrapedHikes.csv, from an index in the cache
+        which is only rebuilt if the .csv has been changed some other way"""
+    recover_scraped_hikes()
+    if not os.path.exists(scraped_hikes_file):
+        return set()
+    index_file = f"{cache_folder}\\{scraped_hikes_file}.urls"
+    if os.path.exists(index_file) and os.path.exists(f"{index_file}.key"):
+        with open(f"{index_file}.key", encoding="utf-8") as kf:
+            if kf.read() == file_key(scraped_hikes_file):
+                with open(index_file, encoding="utf-8") as index:
+                    return {*index.read().split()}
+    urls = pl.read_csv(scraped_hikes_file, columns=["URL"],
+                       schema_overrides={"URL": pl.String})["URL"]
+    os.makedirs(cache_folder, exist_ok=True)
+    replace_file(index_file, "".join(f"{url}\n" for url in urls).encode())
+    replace_file(f"{index_file}.key", file_key(scraped_hikes_file).encode())
+    return {*urls}
+
+
+def file_key(file: str) -> str:
+    stats = os.stat(file)
+    return f"{stats.st_size}:{stats.st_mtime_ns}"
+
+
+def replace_file(file: str, data: bytes):
+    """Write a whole file under a temporary name then rename it, so that
+        it is never seen part-written"""
+    with open(f"{file}.tmp", "wb") as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(f"{file}.tmp", file)
+
+
+def scrape_past_events_for_chris_hikes(
+        pages: int = 1, known_urls: {str} = frozenset(),
+        url: str = meetup_past_events_url
+) -> pl.DataFrame:
+    """Chris' hikes from up to the given number of Past Events pages (newest
+        first), fetched through one pooled session.  Each page after the
+        first is found by the cursor in the page before's Apollo state, so
+        they are fetched one at a time.  Stops at the last page, or after
+        the first page that has no events new to this scrape (as when the
+        listing shifts between requests) or has a hike already in
+        known_urls.  Each hike is returned once.  Each page's ETag and
+        Last-Modified are kept in the cache, so an unchanged page costs a
+        304 response"""
+    cached_pages = {}
+    if os.path.exists(meetup_pages_file):
+        with open(meetup_pages_file, encoding="utf-8") as cf:
+            cached_pages = json.load(cf)
+    event_details, seen_urls, cursor = [], set(), None
+    with requests.Session() as session:
+        for _ in range(pages):
+            events, cursor = fetch_events_page(
+                session, past_events_page_url(url, cursor), cached_pages)
+            hikes = [ev[:5] for ev in events if ev[5] == meetup_host_id]
+            event_details += hikes
+            page_urls = {ev[3] for ev in events}
+            if (cursor is None or not page_urls - seen_urls or
+                    any(h[3] in known_urls for h in hikes)):
+                break
+            seen_urls |= page_urls
+    os.makedirs(cache_folder, exist_ok=True)
+    with open(meetup_pages_file, "w", encoding="utf-8") as cf:
+        json.dump(cached_pages, cf)
+    return pl.DataFrame(
+        event_details,
+        schema=["Date", "Title", "Attendees", "URL", "Source"],
+        orient="row"
+    ).unique("URL", keep="first", maintain_order=True)
+
+
+def past_events_page_url(url: str, cursor: str | None) -> str:
+    """The Past Events page that follows the given cursor.  Meetup's own
+        page fetches what follows with this cursor as the "after" variable
+        of a GraphQL query: that the page URL accepts it as an "after"
+        parameter too has not been checked against the live site"""
+    if cursor is None:
+        return url
+    return f"{url}&after={urllib.parse.quote(cursor, safe='')}"
+
+
+def fetch_events_page(session: requests.Session, page_url: str,
+                      cached_pages: dict) -> ([tuple], str | None):
+    """All events on one Past Events page, as (date, title, attendees, id,
+        source, host's member id), and the cursor for the next page (None
+        if this is the last), from the cache if the page is unchanged"""
+    cached = cached_pages.get(page_url, {})
+    headers = {
+        header: cached[validator]
+        for header, validator in (("If-None-Match", "etag"),
+                                  ("If-Modified-Since", "last_modified"))
+        if validator in cached
+    }
+    response = session.get(page_url, headers=headers, timeout=30)
+    if response.status_code == 304:
+        return [tuple(ev) for ev in cached["events"]], cached.get("cursor")
+    response.raise_for_status()
+    apollo = apollo_state(response.text)
+    events, cursor = events_in_apollo_state(apollo), next_events_cursor(apollo)
+    cached_pages[page_url] = {
+        validator: response.headers[header]
+        for header, validator in (("ETag", "etag"),
+                                  ("Last-Modified", "last_modified"))
+        if header in response.headers
+    } | {"events": events, "cursor": cursor}
+    return events, cursor
+
+
+def apollo_state(html: str) -> dict:
     soup = bs(html, "lxml")
     json_tag = soup.find("script", {"type": "application/json"})
     js = json.loads(json_tag.text)
-    apollo = js['props']['pageProps']['__APOLLO_STATE__']
+    return js['props']['pageProps']['__APOLLO_STATE__']
+
+
+def events_in_apollo_state(apollo: dict) -> [tuple]:
     event_keys = [
         *filter(lambda k: k.startswith("Event"),
                 apollo.keys()
                 )
     ]
-    for ek in event_keys:
-        ev = apollo[ek]
-        if ev['eventHosts'][0]['memberId'] == "14080424":
-            event_details.append(
-                (
-                    ev['dateTime'][:10],
-                    ev['title'],
-                    ev['going']['totalCount'],
-                    ev['id'],
-                    "Free",
-                )
-            )
-    return pl.DataFrame(
-        event_details,
-        schema=["Date", "Title", "Attendees", "URL", "Source"],
-        orient="row"
-    )
+    return [
+        (
+            ev['dateTime'][:10],
+            ev['title'],
+            ev['going']['totalCount'],
+            ev['id'],
+            "Free",
+            ev['eventHosts'][0]['memberId'],
+        )
+        for ev in map(apollo.get, event_keys)
+    ]
+
+
+def next_events_cursor(apollo: dict) -> str | None:
+    """The endCursor of the connection (edges and pageInfo) of events in
+        an Apollo state, or None if its pageInfo says there's no next page,
+        or there is no such connection"""
+    def connections(value):
+        if isinstance(value, dict):
+            if "edges" in value and "pageInfo" in value:
+                yield value
+            for item in value.values():
+                yield from connections(item)
+        elif isinstance(value, list):
+            for item in value:
+                yield from connections(item)
+
+    for connection in connections(apollo):
+        if any(str(edge.get("node", {}).get("__ref", "")).startswith("Event:")
+               for edge in connection["edges"]):
+            page_info = connection["pageInfo"]
+            page_info = apollo.get(page_info.get("__ref"), page_info)
+            if page_info.get("hasNextPage"):
+                return page_info.get("endCursor")
+            return None
+    return None
 
 
 def ensure_correct_date_in_gpx_file(
@@ -505,34 +2407,10 @@ def ensure_correct_date_in_gpx_file(
     filename = [*filter(lambda fn: re.search(file_fragment, fn) and
                         fn[-4:] == ".gpx",
                         os.listdir(folder_path))][0]
-    message = f"Setting date to {correct_date} for {folder_path}\\{filename}"
-    with open(f"{folder_path}\\{filename}", encoding="utf-8") as file:
-        text = file.read()
-    existing_date = gpx_date_in_file(f"{folder_path}\\{filename}")
-    if existing_date:
-        if existing_date != correct_date:
-            print(message)
-            new_text = text.replace(f"{existing_date}", f"{correct_date}")
-        else:
-            return f"{folder_path}\\{filename}"
-    else:
-        print(message, "(Date was not present)")
-        metadata = f"\n<metadata>\n\t<time>{correct_date}</time>\n</metadata>"
-        found_metadata = re.search("<metadata>.+</metadata>", text)
-        if found_metadata:
-            new_text = text.replace(
-                "<metadata>",
-                f"<metadata>\n\t<time>{correct_date}</time>\n"
-            )
-        else:
-            insert_at_position = re.search("<gpx .+>", text).end()
-            new_text = text[:insert_at_position] + metadata + text[insert_at_position:]
     corrected_file = f"{folder_path}\\{filename[:-4]}_time-corrected.gpx"
-    with open(
-            corrected_file, "w",
-            encoding="utf-8"
-    ) as new_file:
-        new_file.write(new_text)
+    if not set_gpx_date(f"{folder_path}\\{filename}", correct_date,
+                        corrected_file):
+        return f"{folder_path}\\{filename}"
     os.rename(
         f"{folder_path}\\{filename}",
         f"{folder_path}\\{filename[:-4]}._gpx",
@@ -540,42 +2418,205 @@ def ensure_correct_date_in_gpx_file(
     return corrected_file
 
 
+def correct_gpx_dates(corrections: [(str, str)] = ()) -> [str]:
+    """Set the date of each .gpx file in a list of (file, date) corrections,
+        by default the GPX file and Date of every hike in HikeDetails.csv,
+        in place (see set_gpx_date).  Files that can't be corrected are
+        reported and skipped.  Returns the files that were changed"""
+    if not corrections:
+        corrections = read_hike_details().select("GPX", "Date").drop_nulls(
+        ).iter_rows()
+    changed = []
+    for file, date in corrections:
+        try:
+            if set_gpx_date(file, date):
+                changed.append(file)
+        except (ValueError, OSError) as error:
+            print(f"{file} date not corrected: {error!r}")
+    print(f"Dates corrected in {len(changed)} .gpx files")
+    return changed
+
+
+def set_gpx_date(file_path: str, date: str, output_file: str = "") -> bool:
+    """Make the date of a .gpx file (the <time> in its <metadata>, either
+        added, at midnight, if missing) the given YYYY-MM-DD, keeping any
+        time of day.  Only the start of the file, as far as the end of the
+        metadata, is read in: the rest is streamed through unchanged to
+        output_file (by default the file itself), which is replaced in one
+        step.  Returns False, writing nothing, if the date was already right"""
+    with open(file_path, "rb") as source:
+        head, found = b"", None
+        while not found:
+            chunk = source.read(8_192)
+            if not chunk:
+                raise ValueError(
+                    f"{file_path} has no <gpx> element" if b"<gpx" not in head
+                    else f"{file_path} has no complete <metadata> or other "
+                         f"element in its <gpx> element")
+            head += chunk
+            found = re.search(
+                rb"<gpx\b[^>]*>(?:\s|<!--.*?-->|<\?.*?\?>)*"
+                rb"(?:(?P<empty><metadata\b[^>]*?)\s*/>"
+                rb"|<metadata\b[^>]*>(?P<content>.*?)</metadata>"
+                rb"|<(?!metadata\b)[A-Za-z][^>]*>)",
+                head, flags=re.DOTALL
+            )
+        new_date = date.encode()
+        new_time = b"<time>" + new_date + b"T00:00:00Z</time>"
+        if found.group("empty"):
+            print(f"Setting date to {date} for {file_path} (Date was not present)")
+            head = (head[:found.start("empty")] + found.group("empty") + b">\n\t"
+                    + new_time + b"\n</metadata>" + head[found.end():])
+        elif found.group("content") is None:
+            print(f"Setting date to {date} for {file_path} (Date was not present)")
+            at = head.index(b">", found.start()) + 1
+            insert = b"\n<metadata>\n\t" + new_time + b"\n</metadata>"
+            head = head[:at] + insert + head[at:]
+        elif existing := re.search(rb"<time>\s*([^<]*?)\s*</time>",
+                                   found.group("content")):
+            old_time = existing.group(1)
+            if old_time[:10] == new_date:
+                return False
+            print(f"Setting date to {date} for {file_path}")
+            at = found.start("content") + existing.start(1)
+            head = head[:at] + new_date + old_time[10:] + head[at + len(old_time):]
+        else:
+            print(f"Setting date to {date} for {file_path} (Date was not present)")
+            following = re.search(rb"<(?:keywords|bounds|extensions)\b|\Z",
+                                  found.group("content"))
+            at = found.start("content") + following.start()
+            head = head[:at] + b"\t" + new_time + b"\n" + head[at:]
+        output_file = output_file or file_path
+        with open(f"{output_file}.tmp", "wb") as temp_file:
+            temp_file.write(head)
+            shutil.copyfileobj(source, temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+    os.replace(f"{output_file}.tmp", output_file)
+    return True
+
+
 def snip_at(file_path: str, station_name: str, discard_before: bool = True):
     """Snip off unwanted part of a .gpx file, at either a named station
         or (lat, long) tuple.  Discard the section either before
         or after the snip"""
-    if isinstance(station_name, str):
-        snip_location = locate_station(station_name)
+    if discard_before:
+        snip_gpx_file(file_path, starts=[station_name])
     else:
-        print(f"Supplied co-ordinates: {station_name}")
-        snip_location = geo.Location(*station_name)
-    gpx = gpxpy.parse(open(file_path, "r", encoding="utf-8"))
-    os.rename(file_path, file_path.replace(".", "._"))
-    all_points = gpx.tracks[0].segments[0].points
-    if not discard_before:
-        all_points = all_points[::-1]
-    for i, point in enumerate(all_points):
-        if point.distance_2d(snip_location) < 100:
-            if not discard_before:
-                i = len(all_points) - 1 - i
-            print(f"Point {i} of {len(gpx.tracks[0].segments[0].points)} is close enough to {station_name} station")
-            discard_segment, new_segment = gpx.tracks[0].segments[0].split(i)
-            if not discard_before:
-                new_segment, discard_segment = discard_segment, new_segment
-            gpx.tracks[0].segments[0] = new_segment
-            xml = gpx.to_xml()
-            with open(f"{file_path[:-4]}-snipped{file_path[-4:]}", "w", encoding="utf-8") as output_file:
-                output_file.write(xml)
-            break
-    print(f"There are now {len(gpx.tracks[0].segments[0].points)} points.")
-    return snip_location
-
-
+        snip_gpx_file(file_path, ends=[station_name])
+    return snip_location(station_name)
+
+
+def snip_gpx_files(snip_list: str = snips_file) -> [str]:
+    """Snip each .gpx file listed in snip_list, a .csv of File, Start and
+        End, where Start and End are places as for snip_gpx_file (station
+        names, or "lat, long"), several separated by ";", or left blank.
+        Files that can't be snipped, or with nothing to snip at, are
+        reported and skipped.  Returns the snipped files"""
+    df_snips = pl.read_csv(
+        snip_list, schema={"File": pl.String, "Start": pl.String, "End": pl.String}
+    )
+    snipped = []
+    for file_path, *places in df_snips.iter_rows():
+        starts, ends = (
+            [snip_place(place) for place in (text or "").split(";") if place.strip()]
+            for text in places
+        )
+        if not starts and not ends:
+            print(f"{file_path} not snipped: no start or end given")
+            snipped.append("")
+            continue
+        try:
+            snipped.append(snip_gpx_file(file_path, starts, ends))
+        except (ValueError, AssertionError, OSError,
+                gpxpy.gpx.GPXException) as error:
+            print(f"{file_path} not snipped: {error!r}")
+            snipped.append("")
+    print(f"{sum(map(bool, snipped))} of {len(snipped)} files snipped")
+    return [*filter(None, snipped)]
+
+
+def snip_place(text: str) -> str | tuple[float, float]:
+    """a station name, or "lat, long" as a tuple"""
+    coordinates = re.fullmatch(r"\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*", text)
+    if coordinates:
+        return tuple(map(float, coordinates.groups()))
+    return text.strip()
+
+
+def snip_gpx_file(file_path: str, starts=(), ends=()) -> str:
+    """Write <file>-snipped.gpx, keeping the track from where it leaves
+        each of the starts to where it last reaches each of the ends (places
+        are station names or (lat, long), see snip_range).  Track points are
+        cut from the file's text, so everything else in it is kept as it
+        was, and the original is renamed to ._gpx.  Returns the snipped
+        file, or "" if it couldn't be snipped"""
+    with open(file_path, encoding="utf-8") as gpx_file:
+        text = gpx_file.read()
+    segments = len(re.findall(r"<trkseg\b", text))
+    if segments != 1:
+        raise ValueError(f"{file_path} has {segments} track segments, not one")
+    df_points = gpx_points_frame(file_path)
+    kept = snip_range(df_points["latitude"], df_points["longitude"],
+                      [snip_location(place) for place in starts],
+                      [snip_location(place) for place in ends])
+    if not kept:
+        print(f"{file_path} not snipped: "
+              f"the track doesn't pass within {snip_radius_metres}m of "
+              f"{' and '.join(map(str, [*starts, *ends]))}, or not in order")
+        return ""
+    first, last = kept
+    track_points = [m.span() for m in re.finditer(
+        r"<trkpt\b(?:[^>]*/>|.*?</trkpt>)", text, flags=re.DOTALL)]
+    if len(track_points) != len(df_points):
+        raise ValueError(f"{file_path}: track points not found in its text")
+    snipped_file = f"{file_path[:-4]}-snipped{file_path[-4:]}"
+    replace_file(snipped_file, (
+        text[:track_points[0][0]] +
+        text[track_points[first][0]:track_points[last - 1][1]] +
+        text[track_points[-1][1]:]
+    ).encode("utf-8"))
+    os.rename(file_path, f"{file_path[:-4]}._gpx")
+    print(f"{file_path}: kept points {first} to {last - 1} of {len(df_points)}, "
+          f"there are now {last - first} points.")
+    return snipped_file
+
+
+def snip_range(latitudes, longitudes, starts: [geo.Location] = (),
+               ends: [geo.Location] = (),
+               radius_metres: int = snip_radius_metres) -> tuple[int, int] | None:
+    """(first, last + 1) of the points of a route to keep: those after the
+        first point within radius_metres of each of the starts, up to and
+        including the last point within radius_metres of each of the ends.
+        The distances from every point to every place are found at once.
+        None if the route misses any of the places, or leaves nothing"""
+    places = [*starts, *ends]
+    close = haversine_distances(
+        np.asarray(latitudes)[:, None], np.asarray(longitudes)[:, None],
+        [[place.latitude for place in places]],
+        [[place.longitude for place in places]]
+    ) < radius_metres
+    if not close.any(axis=0).all():
+        return None
+    first = int(close[:, :len(starts)].argmax(axis=0).max(initial=-1)) + 1
+    last = len(close) - int(
+        close[::-1, len(starts):].argmax(axis=0).max(initial=0))
+    return (first, last) if first < last else None
+
+
+def snip_location(place: str | tuple[float, float]) -> geo.Location:
+    if isinstance(place, str):
+        return locate_station(place)
+    print(f"Supplied co-ordinates: {place}")
+    return geo.Location(*place)
+
+
+@functools.cache
 def locate_station(station_name: str) -> geo.Location:
-    station_pos = build_stations_df().filter(
-        station_name=station_name
-    ).row(0)[1:]
-    return geo.Location(*station_pos)
+    df_station = stations_df().filter(station_name=station_name)
+    if df_station.is_empty():
+        raise ValueError(f"there is no station called {station_name}")
+    return geo.Location(*df_station.row(0)[1:])
 
 
 # def missing_hikes(start_year: int = 2019) -> pd.DataFrame:
@@ -594,13 +2635,7 @@ def locate_station(station_name: str) -> geo.Location:
 
 def df_from_gpx(path: str) -> pl.DataFrame:
     """Make a DataFrame containing all gpx points in the file"""
-    points = gpxpy_points_from_gpx_file(path)
-    data = {
-        prop: [pt.__getattribute__(prop) for pt in points]
-        for prop in ("latitude", "longitude", "elevation", "time")
-        if prop in dir(points[0])
-    }
-    return pl.DataFrame(data)
+    return reduce_route(gpx_points_frame(path))
 
 
 def detailed_route_plot(gpx_file: str = ""):
@@ -638,10 +2673,8 @@ def detailed_route_plot(gpx_file: str = ""):
         {"color": "blue", "opacity": 0.3, "weight": 5},
         tooltip=folium.Tooltip(
             f"{distance_description(
-                get_total_distance(
-                    [geo.Location(*pt[::-1]) for pt in points]
-                )
-        )}",
+                route_distances(df["latitude"], df["longitude"])[0]
+            )}",
             style="font-size: 30px;"
         )
     )
@@ -678,11 +2711,18 @@ def detailed_route_plot(gpx_file: str = ""):
     )
 
 
-def rollback(chosen_file: str = ""):
-    """select a previous HikeDetails.csv file to roll back to,
-        and delete and .pts files created after that date"""
+def rollback(chosen_file: str = "", prune: bool = False):
+    """select a previous version of HikeDetails.csv to roll back to, and
+        if prune is set, delete the routes of hikes added after it"""
     previous_files = dict(
-        enumerate(os.listdir("Previous Hike Details"), start=1)
+        enumerate(
+            (f"{timestamp}.csv" for timestamp in sorted(
+                {int(f[:-4]) for f in os.listdir(history_folder)
+                 if f.endswith(".csv") and f[:-4].isnumeric()} |
+                history_versions().keys()
+            )),
+            start=1
+        )
     )
     if not chosen_file:
         selected = input(
@@ -690,8 +2730,7 @@ def rollback(chosen_file: str = ""):
             f"{show_options_list([
                 arrow.get(int(v[:-4])).format(
                     'ddd DD MMM HH:mm:ss') + (" " * 55)
-                for v in previous_files.values() 
-                if v[:-4].isnumeric()
+                for v in previous_files.values()
             ])}"
         )
         if (selected.isnumeric() and
@@ -702,24 +2741,16 @@ def rollback(chosen_file: str = ""):
             return
     rollback_time = arrow.get(int(chosen_file[:-4])) if (
         chosen_file[:-4].isnumeric()) else 0
-    os.remove("HikeDetails.csv")
-    shutil.copy(
-        f"Previous Hike Details\\{chosen_file}",
-        "HikeDetails.csv"
-    )
+    df_previous = read_hike_details(chosen_file)
+    if prune:
+        later_urls = {*read_hike_details()["URL"]} - {*df_previous["URL"]}
+        print(f"Deleting routes for {len(later_urls)} later hikes")
+        for url in later_urls:
+            if os.path.exists(f"routes\\{url}.pts"):
+                os.remove(f"routes\\{url}.pts")
+        delete_routes(later_urls)
+    replace_file("HikeDetails.csv", df_previous.write_csv().encode())
     print(f"{rollback_time=}")
-        # TODO: re-instate this code when going live
-        # rf = "routes"
-        # pts_to_remove = filter(
-        #     lambda p: os.path.getmtime(f"{rf}\\{p}") >
-        #               rollback_time.timestamp(),
-        #     os.listdir(f"{rf}")
-        # )
-        # for pf in pts_to_remove:
-        #     os.remove(f"{rf}\\{pf}")
-
-
-df_stations = build_stations_df()
 
 
 if __name__ == "__main__":
@@ -730,17 +2761,67 @@ if __name__ == "__main__":
                            help='[B] build map\n'
                                 '[S] scrape meetup for new events\n'
                                 '[D] plot a detailed route\n'
-                                '[R] roll back to a previous state\n')
+                                '[R] roll back to a previous state\n'
+                                '[M] migrate .pts files to the route store\n'
+                                '[V] export the routes as vector tiles\n'
+                                '[T] trim the gpx files listed in gpx_snips.csv\n'
+                                '[N] normalise gpx file dates to HikeDetails\n')
+    my_parser.add_argument('--profile',
+                           action='store_true',
+                           help='report directory scans, route lookups, and '
+                                'the time and memory taken by each stage '
+                                '(written to page\\build_profile.json)')
+    my_parser.add_argument('--compact',
+                           action='store_true',
+                           help='embed routes in map.html as encoded polylines')
+    my_parser.add_argument('--tiled',
+                           action='store_true',
+                           help="fetch each year's routes only when shown")
+    my_parser.add_argument('--lod',
+                           action='store_true',
+                           help='simplify routes to suit the zoom level')
+    my_parser.add_argument('--grouped',
+                           action='store_true',
+                           help="draw each year's routes as one GeoJson layer")
+    my_parser.add_argument('--network',
+                           action='store_true',
+                           help='add a layer drawing each shared path once')
+    my_parser.add_argument('--batch',
+                           action='store_true',
+                           help='allocate gpx files that clearly match a '
+                                'hike without asking')
+    my_parser.add_argument('--headless',
+                           action='store_true',
+                           help='as --batch, but leave any other gpx files '
+                                'in Downloads rather than asking')
+    my_parser.add_argument('--prune',
+                           action='store_true',
+                           help='on roll back, delete routes added since')
+    my_parser.add_argument('--pages',
+                           type=int, default=1,
+                           help='number of past events pages to scrape')
     args = my_parser.parse_args()
     op = args.Operation.upper()
 
     options = {
-        "B": build_map,
-        "S": check_and_update_meetup_events,
+        "B": functools.partial(build_map, compact=args.compact,
+                               tiled=args.tiled, lod=args.lod,
+                               grouped=args.grouped, network=args.network,
+                               batch=args.batch, headless=args.headless),
+        "S": functools.partial(check_and_update_meetup_events,
+                               pages=args.pages),
         "D": detailed_route_plot,
-        "R": rollback,
+        "R": functools.partial(rollback, prune=args.prune),
+        "M": migrate_points_files,
+        "V": export_vector_tiles,
+        "T": snip_gpx_files,
+        "N": correct_gpx_dates,
     }
     if op in options:
+        if args.profile:
+            start_profiling()
         options[op]()
+        if args.profile:
+            print_profile_report(op)
     else:
         print(f"{op} is not a valid operation code")
@@ -1,12 +1,21 @@
 import map_builder as mb
 import os
 import arrow
+import numpy as np
 from numpy import dtype
 from gpxpy import geo
 import shutil
 import gpxpy
 import re
 import polars as pl
+import json
+import time
+import folium
+import threading
+import tracemalloc
+import hashlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
 from polars.testing import assert_frame_equal
 
 
@@ -19,6 +28,7 @@ def test_historic_hikes():
     assert "2022-11-04" not in df_scraped["Date"]
     assert df_scraped.item(0, 1).startswith(
         "Nature near London - The only moat in Middlesex")
+    assert_frame_equal(mb.parse_original_meetup_scrape(), df_scraped)
     df_all_historic = mb.all_historic_hikes()
     assert len(df_all_historic) == 216
 
@@ -87,6 +97,52 @@ def test_correcting_dates():
         os.rename(f"{test_folder}\\{corrected_file[:-19]}._gpx", f"{test_folder}\\{corrected_file[:-19]}.gpx")
 
 
+def test_batch_date_correction():
+    track_points = "".join(f'<trkpt lat="51.5" lon="{-0.2 + i / 1_000:.3f}">'
+                           f"<time>2023-01-01T09:{i:02}:00Z</time></trkpt>\n" for i in range(60))
+    headers = {
+        "test_dates_none.gpx": "",
+        "test_dates_wrong.gpx": "<metadata><name>Hike</name><time>2023-01-01T09:30:00Z</time></metadata>",
+        "test_dates_untimed.gpx": '<metadata>\n<name>Hike</name>\n<bounds minlat="51"/>\n</metadata>',
+        "test_dates_right.gpx": "<metadata><time>2024-02-03T10:00:00Z</time></metadata>",
+    }
+    prefix = '<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" creator="test">'
+    headers["test_dates_split.gpx"] = (" " * (8_192 - len(prefix) - len("<metad"))
+                                       + headers["test_dates_wrong.gpx"])    # read splits "<metad"
+    headers["test_dates_comment.gpx"] = "<!-- c --><?pi x?>\n" + headers["test_dates_wrong.gpx"]
+    headers["test_dates_empty.gpx"] = "\n<metadata/>"
+    for file, header in headers.items():
+        with open(file, "w", encoding="utf-8") as gpx_file:
+            gpx_file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" creator="test">'
+                           f"{header}\n<trk><trkseg>\n{track_points}</trkseg></trk>\n</gpx>\n")
+    with open("test_dates_bad.gpx", "w", encoding="utf-8") as gpx_file:
+        gpx_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" creator="test">')
+    mtime = os.path.getmtime("test_dates_right.gpx")
+    bad_files = ["test_dates_bad.gpx", "test_dates_missing.gpx"]     # reported and skipped
+    assert mb.correct_gpx_dates([(file, "2024-02-03") for file in [*bad_files, *headers]]) == [
+        file for file in headers if file != "test_dates_right.gpx"]
+    assert os.path.getmtime("test_dates_right.gpx") == mtime
+    for file in headers:
+        with open(file, encoding="utf-8") as gpx_file:
+            text = gpx_file.read()
+        assert text.endswith(f"<trk><trkseg>\n{track_points}</trkseg></trk>\n</gpx>\n")
+        assert text.count("<metadata>") == 1
+        assert mb.gpx_date_in_file(file) == "2024-02-03"
+        with open(file, encoding="utf-8") as gpx_file:
+            gpx = gpxpy.parse(gpx_file)
+        assert gpx.time.date().isoformat() == "2024-02-03"
+        assert gpx.tracks[0].segments[0].points[0].time.date().isoformat() == "2023-01-01"
+    with open("test_dates_wrong.gpx", encoding="utf-8") as gpx_file:
+        assert "<time>2024-02-03T09:30:00Z</time></metadata>" in gpx_file.read()
+    with open("test_dates_untimed.gpx", encoding="utf-8") as gpx_file:
+        assert "<name>Hike</name>\n\t<time>2024-02-03T00:00:00Z</time>\n<bounds" in gpx_file.read()
+    with open("test_dates_comment.gpx", encoding="utf-8") as gpx_file:
+        assert '"test"><!-- c --><?pi x?>\n<metadata><name>' in gpx_file.read()
+    assert not any(os.path.exists(f"{file}.tmp") for file in headers)
+    for file in [*headers, "test_dates_bad.gpx"]:
+        os.remove(file)
+
+
 def verify_valid_points_format(points: [(float,)]) -> bool:
     assert len(points) > 800
     assert all(isinstance(c, float)
@@ -114,8 +170,76 @@ def test_working_with_points_files():
     mb.points_to_file(gpx_pts, tf1)
     tp1 = mb.points_from_file(tf1)
     verify_valid_points_format(tp1)
-    for del_file in (test_file, tf1):
-        safe_remove(f"routes\\{del_file}.pts")
+    mb.delete_routes([test_file, tf1])
+    assert mb.points_from_file(test_file) == []
+
+
+def test_route_index_scans_routes_once():
+    mb.known_routes.cache_clear()
+    mb.profile_counts.clear()
+    for url in mb.read_hike_details()["URL"]:
+        mb.points_from_file(url)
+    assert mb.profile_counts["scans of routes"] == 1
+    assert mb.profile_counts["route lookups"] == len(mb.read_hike_details())
+
+
+def test_route_store():
+    stems = [f"test_route_store_{n}" for n in range(3)]
+    routes = {
+        stem: [geo.Location(51.5 + n / 10 + i / 1000, -0.1 - i / 1000)
+               for i in range(50 + n)]
+        for n, stem in enumerate(stems)
+    }
+    mb.compact_route_store()
+    store_key = mb.mtimes_key(*filter(os.path.exists, [mb.route_store_file]))
+    for stem, points in routes.items():
+        mb.points_to_file(points, stem)
+    assert mb.mtimes_key(*filter(os.path.exists, [mb.route_store_file])) == store_key
+    assert mb.staged_routes()["URL"].unique(maintain_order=True).to_list() == stems
+    for stem, points in routes.items():
+        assert mb.points_from_file(stem) == [
+            (pt.latitude, pt.longitude) for pt in points]
+    mb.points_to_file(routes[stems[0]][:10], stems[1])
+    assert len(mb.points_from_file(stems[1])) == 10
+    mb.compact_route_store()
+    assert not os.path.exists(mb.route_stage_file)
+    assert len(mb.points_from_file(stems[1])) == 10
+    assert mb.points_from_file(stems[0]) == [(pt.latitude, pt.longitude) for pt in routes[stems[0]]]
+    assert mb.points_from_file(stems[2], longitude_first=True)[0] == (
+        -0.1, 51.7)
+    assert mb.route_frame(stems[2])["significance"][0] == np.inf
+    mb.delete_routes(stems)
+    assert all(mb.points_from_file(stem) == [] for stem in stems)
+
+
+def test_route_distances_match_gpxpy():
+    rng = np.random.default_rng(7)
+    lats = 51.5 + np.cumsum(rng.normal(0, 0.0003, 2_000))
+    longs = -0.15 + np.cumsum(rng.normal(0, 0.0005, 2_000))
+    longs[1_000:] += 0.3    # one leg long enough to use haversine
+    route = [geo.Location(lat, long) for lat, long in zip(lats, longs)]
+    expected = sum(
+        pt.distance_2d(last_pt) for last_pt, pt in zip(route, route[1:])
+    )
+    total, cumulative = mb.route_distances(lats, longs)
+    assert len(cumulative) == len(route)
+    assert cumulative[0] == 0
+    assert abs(cumulative[-1] - expected) < 1e-3
+    assert total == int(expected)
+    assert mb.get_total_distance(route) == total
+
+
+def test_route_distances_match_hike_details():
+    """totals from the .pts files agree with the Distance column
+        (calculated with gpxpy) to within 1 metre"""
+    tolerance_metres = 1
+    for url, distance in mb.read_hike_details().select(
+            "URL", "Distance").iter_rows():
+        points = mb.points_from_file(url)
+        if points:
+            lats, longs = zip(*points)
+            total, _ = mb.route_distances(lats, longs)
+            assert abs(total - distance) <= tolerance_metres
 
 
 def safe_remove(path: str):
@@ -209,6 +333,470 @@ def test_station_finding():
     print(dfh)
 
 
+def test_station_index():
+    """grid index agrees with a brute-force search of the whole table"""
+    assert mb.nearest_stations(
+        [51.485628, 52.066359], [-0.606757, 0.208629]
+    )[0] == "Windsor & Eton Riverside"
+    assert mb.find_proximate_station(
+        geo.Location(51.4857, -0.6068), radius_metres=1) is None
+    df = mb.stations_df().drop_nulls(["latitude", "longitude"])
+    rng = np.random.default_rng(3)
+    lats, longs = rng.uniform(51.2, 51.8, 200), rng.uniform(-0.7, 0.5, 200)
+    for radius in (500, 2_000, 5_000):
+        expected = []
+        for lat, long in zip(lats, longs):
+            distances = mb.haversine_distances(
+                lat, long, df["latitude"], df["longitude"])
+            nearest = distances.argmin()
+            expected.append(df["station_name"][int(nearest)]
+                            if distances[nearest] <= radius else None)
+        assert mb.nearest_stations(lats, longs, radius) == expected
+
+
+def test_cached_station_table():
+    mb.stations_df.cache_clear()
+    df_fresh = mb.build_stations_df()
+    assert_frame_equal(mb.stations_df(), df_fresh)
+    assert os.path.exists(f"{mb.cache_folder}\\stations.parquet")
+    mb.stations_df.cache_clear()
+    assert_frame_equal(mb.stations_df(), df_fresh)
+
+
+def test_incremental_route_fragments():
+    urls = ["test_fragment_1", "test_fragment_2"]
+    for n, url in enumerate(urls):
+        mb.points_to_file(
+            [geo.Location(51.5 + i / 1000, -0.1 * n) for i in range(20)], url)
+    dfh = pl.DataFrame(
+        {
+            "Date": ["2023-05-06", "2024-05-04"], "Title": ["One", "Two"],
+            "URL": urls, "Start": ["A", "B"], "End": ["A", "C"],
+            "Distance": [16_000, 20_000],
+        }
+    )
+    real_folder, mb.fragment_folder = mb.fragment_folder, "test_fragments"
+    try:
+        fragments = mb.route_fragments(dfh)
+        feature = json.loads(fragments[urls[0]])
+        assert feature["geometry"]["coordinates"][1] == [0.0, 51.501]
+        assert "Circular walk from A" in feature["properties"]["tooltip"]
+        fragment_mtimes = [os.path.getmtime(f"{mb.fragment_folder}\\{url}.json")
+                           for url in urls]
+        time.sleep(0.01)
+        mb.points_to_file([geo.Location(52.0, 0.0), geo.Location(52.1, 0.0)], urls[1])
+        assert mb.route_fragments(dfh) != fragments
+        assert [os.path.getmtime(f"{mb.fragment_folder}\\{url}.json")
+                for url in urls][0] == fragment_mtimes[0]
+    finally:
+        remove_test_fragments(urls)
+        mb.fragment_folder = real_folder
+    m = folium.Map()
+    mb.RouteLayer([*fragments.values()]).add_to(folium.FeatureGroup().add_to(m))
+    m.get_root().script.add_child(folium.Element(mb.route_layer_js))
+    html = m.get_root().render()
+    assert html.count("routeFeatures([") == 1
+    assert html.count("Circular walk from A") == 1
+    mb.delete_routes(urls)
+
+
+def remove_test_fragments(urls: [str]):
+    """the fragments, and keys, written to a test fragment_folder"""
+    for name in [*urls, "keys"]:
+        safe_remove(f"{mb.fragment_folder}\\{name}.json")
+    shutil.rmtree(mb.fragment_folder, ignore_errors=True)
+
+
+def test_grouped_year_layers():
+    urls = [f"test_grouped_{n}" for n in range(3)]
+    for n, url in enumerate(urls):
+        mb.points_to_file(
+            [geo.Location(51.5 + i / 1000, -0.1 * n) for i in range(20)], url)
+    real_folder, mb.fragment_folder = mb.fragment_folder, "test_fragments"
+    try:
+        fragments = mb.route_fragments(pl.DataFrame(
+            {
+                "Date": ["2023-05-06", "2023-06-03", "2024-05-04"],
+                "Title": ["One", "Two", "Three"], "URL": urls,
+                "Start": ["A", "B", "C"], "End": ["A", "C", "C"],
+                "Distance": [16_000, 20_000, 18_000],
+            }
+        ))
+    finally:
+        remove_test_fragments(urls)
+        mb.fragment_folder = real_folder
+    m = folium.Map()
+    for year_fragments in ([fragments[url] for url in urls[:2]], [fragments[urls[2]]]):
+        mb.year_layer(year_fragments).add_to(folium.FeatureGroup().add_to(m))
+    html = m.get_root().render()
+    assert html.count("L.geoJson(null") == 2
+    assert html.count("bindTooltip") == 2
+    assert html.count("Circular walk from A") == 1
+    assert html.count('"weight": 8') <= 2
+    mb.delete_routes(urls)
+
+
+def test_route_network():
+    urls = [f"test_network_{n}" for n in range(3)]
+    along = [(51.5, -0.2 + i / 2_000) for i in range(101)]     # ~3.5km east
+    mb.save_routes({
+        urls[0]: pl.DataFrame(along, schema=["lat", "long"], orient="row"),
+        urls[1]: pl.DataFrame(along[::5] + [(51.5 + i / 2_000, -0.15) for i in range(1, 40)],
+                              schema=["lat", "long"], orient="row"),
+        urls[2]: pl.DataFrame([(51.7, -0.1 + i / 2_000) for i in range(50)],
+                              schema=["lat", "long"], orient="row"),
+    })
+    df_network = mb.route_network()
+    df_test = df_network.filter(pl.col("URL").list.first().str.starts_with("test_network"))
+    assert df_test.filter(pl.col("URL").list.len() == 2)["URL"].to_list()[0] == urls[:2]
+    assert all(max(abs(ra - rb), abs(ca - cb)) == 1 for ra, ca, rb, cb, _ in df_test.iter_rows())
+    middle = [(51.5, -0.18), (51.5, -0.16)]
+    assert mb.hikes_on_path(middle) == urls[:2]
+    assert mb.hikes_on_path([(51.5 + i / 2_000, -0.15) for i in range(5, 30)]) == urls[1:2]
+    assert mb.hikes_on_path(middle[:1]) == urls[:2]
+    assert mb.hikes_on_path([(51.6, -0.18), (51.6, -0.16)]) == []
+
+    dfh = pl.DataFrame({"Date": ["2024-01-06", "2024-01-13", "2024-01-20"],
+                        "Title": ["One", "Two", "Three"], "URL": urls})
+    layer = mb.network_layer(dfh)
+    features = layer.data["features"]
+    assert len(features) == 3
+    assert sorted(len(f["geometry"]["coordinates"]) for f in features) == [1, 1, 1]
+    assert sum("2 hikes" in f["properties"]["tooltip"] for f in features) == 1
+    assert mb.chain_edges([((0, 0), (0, 1)), ((0, 1), (1, 1)), ((1, 1), (1, 0)),
+                           ((1, 0), (0, 0))]) == [[(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)]]
+    mb.delete_routes(urls)
+
+
+def decode_protobuf(data: bytes) -> [(int, int | bytes)]:
+    """(field number, value) for each field of a protobuf message"""
+    fields, i = [], 0
+    while i < len(data):
+        key, i = decode_varint(data, i)
+        if key & 7 == 0:
+            value, i = decode_varint(data, i)
+        else:
+            length, i = decode_varint(data, i)
+            value, i = data[i:i + length], i + length
+        fields.append((key >> 3, value))
+    return fields
+
+
+def decode_varint(data: bytes, i: int) -> (int, int):
+    value = shift = 0
+    while data[i] & 0x80:
+        value |= (data[i] & 0x7f) << shift
+        i, shift = i + 1, shift + 7
+    return value | data[i] << shift, i + 1
+
+
+def decode_packed(data: bytes) -> [int]:
+    values, i = [], 0
+    while i < len(data):
+        value, i = decode_varint(data, i)
+        values.append(value)
+    return values
+
+
+def decode_vector_tile(data: bytes) -> dict[str, list[dict]]:
+    """layer name -> features (id, type, properties, lines of (x, y))"""
+    layers = {}
+    for _, layer_data in decode_protobuf(data):
+        layer = decode_protobuf(layer_data)
+        keys = [v.decode() for n, v in layer if n == 3]
+        values = [v.decode() if n == 1 else v for n, v in
+                  (decode_protobuf(value)[0] for f, value in layer if f == 4)]
+        features = []
+        for feature in (dict(decode_protobuf(v)) for n, v in layer if n == 2):
+            tags, geometry = decode_packed(feature[2]), decode_packed(feature[4])
+            lines, x, y, i = [], 0, 0, 0
+            while i < len(geometry):
+                command, count, i = geometry[i] & 7, geometry[i] >> 3, i + 1
+                for _ in range(count):
+                    dx, dy = ((v >> 1) ^ -(v & 1) for v in geometry[i:i + 2])
+                    x, y, i = x + dx, y + dy, i + 2
+                    if command == 1:
+                        lines.append([])
+                    lines[-1].append((x, y))
+            features.append({
+                "id": feature[1], "type": feature[3], "lines": lines,
+                "properties": {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}
+            })
+        layers[dict(layer)[1].decode()] = features
+    return layers
+
+
+def test_vector_tiles():
+    assert mb.protobuf_varints([0, 1, 127, 128, 300]) == b"\x00\x01\x7f\x80\x01\xac\x02"
+    urls = ["test_tiles_0", "test_tiles_1"]
+    mb.save_routes({
+        urls[0]: pl.DataFrame([(51.5, -0.2 + i / 2_000) for i in range(101)],
+                              schema=["lat", "long"], orient="row"),
+        urls[1]: pl.DataFrame([(51.45 + i / 2_000, -0.15 + (i % 2) / 20_000) for i in range(60)],
+                              schema=["lat", "long"], orient="row"),
+    })
+    properties = {url: {"date": "2024-01-06", "title": f"Hike {n}", "distance": 3_500 + n,
+                        "start": "Here", "end": "There"} for n, url in enumerate(urls)}
+    df_routes = mb.read_route_store().filter(pl.col("URL").is_in(urls))
+
+    tiles = mb.vector_tiles(df_routes, properties, 14)
+    assert len(tiles) > 3
+    points = {url: [] for url in urls}
+    for (x, y), data in tiles.items():
+        for feature in decode_vector_tile(data)["hikes"]:
+            assert feature["type"] == 2
+            url = urls[int(feature["properties"]["title"][-1])]
+            assert feature["properties"] == properties[url]
+            for line in feature["lines"]:
+                assert len(line) > 1
+                assert all(-mb.vector_tile_buffer <= c <= mb.vector_tile_extent + mb.vector_tile_buffer
+                           for pt in line for c in pt)
+                points[url] += [((x + px / mb.vector_tile_extent) / 2 ** 14,
+                                 (y + py / mb.vector_tile_extent) / 2 ** 14) for px, py in line]
+    lats, longs = ({url: np.array([(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * v)))), u * 360 - 180)
+                                   for u, v in points[url]])[:, i] for url in urls} for i in (0, 1))
+    assert np.allclose(lats[urls[0]], 51.5, atol=1e-5)
+    assert np.isclose(longs[urls[0]].min(), -0.2, atol=1e-5)
+    assert np.isclose(longs[urls[0]].max(), -0.15, atol=1e-5)
+    assert np.isclose(lats[urls[1]].max(), 51.45 + 59 / 2_000, atol=1e-5)
+
+    properties[urls[1]] |= {"start": None, "distance": None}   # no station near enough
+    tiles = mb.vector_tiles(df_routes.drop("significance"), properties, 5)
+    assert sorted(tiles) == [(15, 10), (16, 10)]     # London is within the buffer of x=16
+    data = tiles[15, 10]
+    features = decode_vector_tile(data)["hikes"]
+    assert [f["id"] for f in features] == [1, 2]
+    assert [len(f["lines"][0]) for f in features] == [2, 2]
+    assert features[1]["properties"] == {"date": "2024-01-06", "title": "Hike 1", "end": "There"}
+
+    db = mb.mbtiles_database("test.mbtiles", {"name": "test", "format": "pbf"})
+    db.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)", (5, 15, 2 ** 5 - 1 - 10, data))
+    db.commit()
+    assert dict(db.execute("SELECT * FROM metadata")) == {"name": "test", "format": "pbf"}
+    db.close()
+    m = mb.tile_map(pl.DataFrame({"Distance": [3_500]}), 5, 14)
+    assert 'tiles/{z}/{x}/{y}.pbf' in m.get_root().render()
+    mb.delete_routes(urls)
+    os.remove("test.mbtiles")
+
+    # a pixel is narrower in metres further north, so more of a route is kept
+    pixel = 2 * np.pi * geo.EARTH_RADIUS / (256 << 10)
+    df_north = pl.DataFrame({"URL": "north", "lat": [60.0, 60.001, 60.002], "long": [10.37] * 3,
+                             "significance": [np.inf, 0.56 * pixel, np.inf]})
+    assert mb.tile_parts(df_north, 10).height == 3
+    assert mb.tile_parts(df_north.with_columns(lat=pl.col("lat") - 10), 10).height == 2
+
+    real_details = mb.read_hike_details
+    mb.read_hike_details = lambda: real_details().clear()
+    try:
+        assert mb.export_vector_tiles() is None     # nothing to tile
+    finally:
+        mb.read_hike_details = real_details
+
+
+def test_tiles_from_points_files():
+    with open("routes\\test_tiles_pts.pts", "w") as pts:
+        pts.write("lat,long\n" + "".join(f"51.4,{-0.3 + i / 1_000}\n" for i in range(20)))
+    mb.clear_route_caches()
+    try:
+        df_routes = mb.tile_routes(["test_tiles_pts", "test_tiles_none"])
+        assert df_routes.columns == ["URL", "lat", "long", "significance"]
+        assert df_routes["URL"].unique().to_list() == ["test_tiles_pts"] and df_routes.height == 20
+    finally:
+        os.remove("routes\\test_tiles_pts.pts")
+        mb.clear_route_caches()
+
+
+def test_year_tiles():
+    fragments = ['{"type": "Feature", "properties": {"tooltip": "a"}}'] * 2
+    url = mb.write_year_tile("1999", fragments)
+    assert url == "routes/1999.json"
+    with open("page\\routes\\1999.json", encoding="utf-8") as tile:
+        assert len(json.loads(tile.read())) == 2
+    m = folium.Map()
+    mb.RouteLayer(url=url).add_to(folium.FeatureGroup().add_to(m))
+    assert 'routes/1999.json");' in m.get_root().render()
+    os.remove("page\\routes\\1999.json")
+
+
+def test_level_of_detail():
+    rng = np.random.default_rng(5)
+    lats = 51.5 + np.cumsum(rng.normal(0, 0.0001, 3_000))
+    longs = -0.15 + np.cumsum(rng.normal(0, 0.00015, 3_000))
+    significance = mb.route_significance(lats, longs)
+    assert significance[0] == significance[-1] == np.inf
+    x, y = (longs * np.cos(np.radians(lats.mean())) * geo.ONE_DEGREE,
+            lats * geo.ONE_DEGREE)
+    for _, tolerance in mb.lod_levels[:-1]:
+        # every dropped point lies within tolerance of the simplified line
+        kept = np.flatnonzero(significance >= tolerance)
+        for first, last in zip(kept, kept[1:]):
+            if last - first > 1:
+                px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+                dx, dy = x[last] - x[first], y[last] - y[first]
+                along = np.clip((px * dx + py * dy) / (dx * dx + dy * dy), 0, 1)
+                assert np.hypot(px - along * dx, py - along * dy).max() < tolerance
+    levels = mb.detail_levels(significance)
+    assert len(levels) == 3_000
+    assert levels[0] == levels[-1] == "0"
+    assert sorted(set(levels)) == ["0", "1", "2", "3"]
+
+
+def test_encoded_polylines():
+    # example from Google's Encoded Polyline Algorithm Format documentation
+    assert mb.encode_polyline(
+        [38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]
+    ) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def write_test_gpx(filename: str, points: [(float,)]):
+    """points are (lat, long) or (lat, long, elevation, time)"""
+    gpx = gpxpy.gpx.GPX()
+    track = gpxpy.gpx.GPXTrack()
+    gpx.tracks.append(track)
+    track.segments.append(gpxpy.gpx.GPXTrackSegment(
+        [gpxpy.gpx.GPXTrackPoint(*pt) for pt in points]))
+    with open(filename, "w", encoding="utf-8") as gpx_file:
+        gpx_file.write(gpx.to_xml())
+
+
+def test_streaming_gpx_reader():
+    rng = np.random.default_rng(13)
+    n = 12_000
+    start_time = arrow.get("2024-03-09T09:00:00Z").datetime
+    file = "test_streaming_gpx_reader.gpx"
+    write_test_gpx(file, zip(
+        51.5 + np.cumsum(rng.normal(0, 0.00005, n)),
+        -0.2 + np.cumsum(rng.normal(0, 0.00008, n)),
+        np.round(50 + np.cumsum(rng.normal(0, 0.5, n)), 1),
+        [start_time.replace(second=s % 60, minute=s // 60 % 60, hour=9 + s // 3600)
+         for s in range(n)]
+    ))
+    df = mb.gpx_points_frame(file)
+    assert_frame_equal(df, mb.gpxpy_points_frame(file))
+    with open(file, encoding="utf-8") as gpx_file:
+        gpx = gpxpy.parse(gpx_file)
+    gpx.reduce_points(max_points_no=n // 10)
+    expected = [(pt.latitude, pt.longitude, pt.elevation)
+                for pt in gpx.tracks[0].segments[0].points]
+    assert [*mb.reduce_route(df).select(
+        "latitude", "longitude", "elevation").iter_rows()] == expected
+    assert [(pt.latitude, pt.longitude, pt.elevation) for pt in
+            mb.gpxpy_points_from_gpx_file(file)] == expected
+    os.remove(file)
+
+
+def test_snipping_gpx_files():
+    points = [(51.5, -0.2 + i / 2_000) for i in range(201)]    # ~35m apart
+    station, lat, long = mb.stations_df().drop_nulls().row(0)
+    files = [f"test_snip_{n}.gpx" for n in range(3)]
+    write_test_gpx(files[0], points)
+    write_test_gpx(files[1], [(lat + i / 2_000, long) for i in range(-50, 51)])
+    write_test_gpx(files[2], points)
+    gpx = gpxpy.gpx.GPX()
+    gpx.tracks.append(gpxpy.gpx.GPXTrack())
+    gpx.tracks[0].segments += [gpxpy.gpx.GPXTrackSegment([gpxpy.gpx.GPXTrackPoint(*pt)
+                                                          for pt in half])
+                               for half in (points[:100], points[100:])]
+    with open("test_snip_segments.gpx", "w", encoding="utf-8") as two_segments:
+        two_segments.write(gpx.to_xml())
+    write_test_gpx("test_snip_blank.gpx", points)
+    lats, longs = zip(*points)
+    assert mb.snip_range(lats, longs, [geo.Location(*points[50])], [geo.Location(*points[150])]) == (49, 153)
+    assert mb.snip_range(lats, longs, [geo.Location(*points[150])], [geo.Location(*points[50])]) is None
+    assert mb.snip_range(lats, longs, [geo.Location(51.6, -0.15)]) is None
+    assert mb.snip_range(lats, longs, [geo.Location(*points[50]), geo.Location(*points[100])],
+                         [geo.Location(*points[180]), geo.Location(*points[150])]) == (99, 153)
+
+    with open(mb.snips_file, "w") as snips:
+        snips.write(f"File,Start,End\n{files[0]},\"{points[50][0]}, {points[50][1]}\","
+                    f"\"{points[150][0]},{points[150][1]}\"\n"
+                    f"{files[1]},,{station}\n{files[2]},{points[50][0]} {points[50][1]},\n"
+                    f"test_snip_segments.gpx,,{station}\ntest_snip_missing.gpx,{station},\n"
+                    f"test_snip_blank.gpx,,\n")
+    assert mb.snip_place(" 51.5,-0.1 ") == (51.5, -0.1) and mb.snip_place(" Oxford ") == "Oxford"
+    assert mb.snip_gpx_files() == [f"test_snip_{n}-snipped.gpx" for n in range(2)]
+    df = mb.gpx_points_frame("test_snip_0-snipped.gpx")
+    assert [*zip(df["latitude"], df["longitude"])] == points[49:153]
+    with open("test_snip_0-snipped.gpx", encoding="utf-8") as snipped:
+        assert snipped.read().startswith('<?xml version="1.0" encoding="UTF-8"?>\n<gpx')
+    assert mb.gpx_points_frame("test_snip_1-snipped.gpx").height == 52
+    assert os.path.exists("test_snip_0._gpx") and not os.path.exists(files[0])
+    assert os.path.exists(files[2])     # "lat long" is taken as a station name
+    assert os.path.exists("test_snip_segments.gpx") and os.path.exists("test_snip_blank.gpx")
+    assert not os.path.exists("test_snip_blank-snipped.gpx")
+    mb.snip_at(files[2], points[-1], discard_before=False)
+    assert mb.gpx_points_frame("test_snip_2-snipped.gpx").height == 201
+    for file in ["test_snip_0._gpx", "test_snip_1._gpx", "test_snip_2._gpx", mb.snips_file,
+                 "test_snip_segments.gpx", "test_snip_blank.gpx",
+                 *(f"test_snip_{n}-snipped.gpx" for n in range(3))]:
+        os.remove(file)
+
+
+def test_gpx_index():
+    monday = arrow.get("2024-03-11T09:00:00Z").datetime
+    gpx_files = [f"test_gpx_index_{n}.gpx" for n in range(3)]
+    for n, file in enumerate(gpx_files):
+        untimed = [(51.5 + i / 1000, -0.1 * n - i / 1000) for i in range(n * 200)]
+        write_test_gpx(file, untimed + [(51.4, -0.2, 10.0, monday.replace(day=11 + n))])
+
+    def files_frame():
+        return pl.DataFrame(
+            [(file, os.stat(file).st_mtime, os.stat(file).st_size) for file in gpx_files],
+            schema=["filename", "mod_timestamp", "size"], orient="row"
+        )
+
+    real_index, mb.gpx_index_file = mb.gpx_index_file, "test_gpx_index.parquet"
+    try:
+        mb.profile_counts.clear()
+        df = mb.gpx_index(files_frame())
+        assert mb.profile_counts["gpx files indexed"] == 3
+        assert df["filename"].to_list() == gpx_files
+        assert df["Date"].to_list() == ["2024-03-11", "2024-03-12", "2024-03-13"]
+        assert df["points"].to_list() == [1, 201, 401]
+        assert df[2, "min_longitude"] == -0.2 - 0.399
+        assert df[2, "max_latitude"] == 51.5 + 0.399
+        for file in gpx_files:
+            with open(file, encoding="utf-8") as gf:
+                assert mb.gpx_date_in_file(file) == re.search("<time>.+</time>", gf.read()).group()[6:16]
+        assert_frame_equal(mb.gpx_index(files_frame()), df)
+        assert mb.profile_counts["gpx files indexed"] == 3
+        write_test_gpx(gpx_files[1], [(51.4, -0.2, 10.0, monday)] * 5)
+        df = mb.gpx_index(files_frame())
+        assert mb.profile_counts["gpx files indexed"] == 4
+        assert df["Date"].to_list() == ["2024-03-11", "2024-03-11", "2024-03-13"]
+        assert df["points"].to_list() == [1, 5, 401]
+        mb.gpx_index(files_frame()[:1])
+        mb.gpx_index(files_frame())    # others not evicted by indexing just one
+        assert mb.profile_counts["gpx files indexed"] == 4
+        df_files = files_frame()[:2]
+        os.remove(gpx_files[2])
+        mb.gpx_index(df_files)    # ... but files that have gone are dropped
+        assert pl.read_parquet(mb.gpx_index_file)["filename"].sort().to_list() == gpx_files[:2]
+    finally:
+        safe_remove(mb.gpx_index_file)
+        mb.gpx_index_file = real_index
+        for file in gpx_files:
+            safe_remove(file)
+
+
+def test_parallel_particulars():
+    rng = np.random.default_rng(11)
+    gpx_files = [f"test_parallel_{n}.gpx" for n in range(6)]
+    for n, file in enumerate(gpx_files):
+        write_test_gpx(file, zip(
+            51.485628 + np.cumsum(rng.normal(0, 0.0002, 500 + 100 * n)),
+            -0.606757 + np.cumsum(rng.normal(0, 0.0003, 500 + 100 * n))
+        ))
+    df = mb.particulars_in_parallel(gpx_files, workers=3)
+    expected = [mb.calculate_hike_particulars(
+        mb.gpxpy_points_from_gpx_file(file)) for file in gpx_files]
+    assert [*df.iter_rows()] == expected
+    assert df.item(0, "Start") == "Windsor & Eton Riverside"
+    for file in gpx_files:
+        os.remove(file)
+
+
 def test_migrate_web_scraping_to_json():
     """TDD for adjusting to meetup format change"""
     scraped_file = "ScrapedHikes.csv"
@@ -309,9 +897,312 @@ def test_rebuild():
     )
 
 
+def test_empty_rebuild():
+    matching_table = mb.hike_matching_table
+    mb.hike_matching_table = lambda: mb.read_hike_details().clear().drop("Start", "End", "Distance")
+    try:
+        df_new = mb.rebuild_hike_details()
+    finally:
+        mb.hike_matching_table = matching_table
+    assert df_new.is_empty() and {"Start", "End", "Distance"} <= set(df_new.columns)
+
+
 def test_detailed_plot():
     # print(mb.df_from_gpx("gpx\\07\\Haslemere_Hills.gpx"))
     # mb.detailed_route_plot("gpx\\07\\Haslemere_Hills.gpx")
     "gpx\\14\\"
     mb.detailed_route_plot()
     # mb.detailed_route_plot("gpx\\14\\Ivinghoe Beacon10-01-2026_time-corrected.gpx")
+
+
+def recorded_events_page(events: [tuple], next_page: int | None = None) -> str:
+    """a Past Events page in the form meetup serves it, for (date, title,
+        attendees, id, host's member id) events, with the cursor of
+        next_page (if there is one) in its pageInfo"""
+    connection = {
+        "__typename": "GroupEventConnection",
+        "pageInfo": {"__typename": "PageInfo", "hasNextPage": next_page is not None,
+                     "endCursor": f"cursor={next_page}" if next_page else None},
+        "edges": [{"__typename": "GroupEventEdge", "node": {"__ref": f"Event:{ev[3]}"}}
+                  for ev in events],
+    }
+    apollo = {
+        f"Event:{ev_id}": {
+            "id": ev_id, "title": title, "dateTime": f"{date}T09:30:00+00:00",
+            "going": {"totalCount": attendees},
+            "eventHosts": [{"memberId": host}],
+        }
+        for date, title, attendees, ev_id, host in events
+    } | {"ROOT_QUERY": {}, "Group:1": {'events({"status":"PAST"})': connection}}
+    next_data = json.dumps({"props": {"pageProps": {"__APOLLO_STATE__": apollo}}})
+    return (f'<html><head></head><body><script id="__NEXT_DATA__" '
+            f'type="application/json">{next_data}</script></body></html>')
+
+
+def test_paginated_meetup_scrape():
+    chris, other = mb.meetup_host_id, "1"
+    events = {
+        n: [(f"2024-0{7 - n}-{d:02}", f"Hike {n}.{d}", d, f"3000{n}{d:04}", host)
+            for d, host in zip(range(20, 0, -5), (chris, other, chris, chris))]
+        for n in range(1, 4)
+    }
+    pages = {n: recorded_events_page(events[n], n + 1 if n < 3 else None) for n in range(1, 4)}
+    served = []
+
+    class MeetupStandIn(BaseHTTPRequestHandler):
+        def do_GET(self):
+            after = parse_qs(urlsplit(self.path).query).get("after", ["cursor=1"])[0]
+            page = int(after.partition("=")[2])
+            body = pages[page].encode()
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                served.append((page, 304))
+                self.send_response(304)
+                self.end_headers()
+                return
+            served.append((page, 200))
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MeetupStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/events/?type=past"
+    real_file, mb.meetup_pages_file = mb.meetup_pages_file, "test_meetup_pages.json"
+    try:
+        df = mb.scrape_past_events_for_chris_hikes(10, url=url)
+        assert len(df) == 9
+        assert df["URL"].to_list()[:3] == ["300010020", "300010010", "300010005"]
+        assert df.columns == ["Date", "Title", "Attendees", "URL", "Source"]
+        assert served == [(n, 200) for n in range(1, 4)]    # page 3 is the last
+        served.clear()
+        assert_frame_equal(
+            mb.scrape_past_events_for_chris_hikes(10, url=url), df)
+        assert served == [(n, 304) for n in range(1, 4)]
+        served.clear()
+        df_new = mb.scrape_past_events_for_chris_hikes(
+            10, known_urls={"300020010"}, url=url)
+        assert_frame_equal(df_new, df.head(6))
+        assert served == [(1, 304), (2, 304)]
+        served.clear()
+        assert_frame_equal(mb.scrape_past_events_for_chris_hikes(1, url=url), df.head(3))
+        assert served == [(1, 304)]
+
+        # the listing shifts by an event between pages, then repeats itself
+        pages[2] = recorded_events_page(events[1][-1:] + events[2][:3], 3)
+        pages[3] = recorded_events_page(events[1], 4)
+        served.clear()
+        df_shifted = mb.scrape_past_events_for_chris_hikes(10, url=url)
+        assert df_shifted["URL"].to_list() == [
+            "300010020", "300010010", "300010005", "300020020", "300020010"]
+        assert [page for page, _ in served] == [1, 2, 3]
+    finally:
+        server.shutdown()
+        os.remove(mb.meetup_pages_file)
+        mb.meetup_pages_file = real_file
+
+
+def test_appending_scraped_hikes():
+    real_file, mb.scraped_hikes_file = mb.scraped_hikes_file, "test_scraped_hikes.csv"
+    df = pl.DataFrame(
+        [(f"2024-05-{d:02}", f"Hike, {d}", d, f"30{d:07}", "Free") for d in range(1, 21)],
+        schema=["Date", "Title", "Attendees", "URL", "Source"], orient="row"
+    )
+    try:
+        assert mb.scraped_urls() == set()
+        assert mb.append_scraped_hikes(df[:5]) == 5
+        assert mb.append_scraped_hikes(df[3:12]) == 7
+        assert mb.append_scraped_hikes(df[3:12]) == 0
+        assert mb.scraped_urls() == {*df[:12]["URL"]}
+        assert_frame_equal(mb.hikes_from_subsequent_scrapes(), df[:12])
+
+        # interrupted after the journal was written, part-way through a row
+        with open(mb.scraped_hikes_file, "rb") as file:
+            size = len(file.read())
+        rows = df[12:15].write_csv(include_header=False)
+        with open(f"{mb.scraped_hikes_file}.journal", "w", encoding="utf-8") as jf:
+            json.dump({"size": size, "rows": rows}, jf)
+        with open(mb.scraped_hikes_file, "a", encoding="utf-8") as file:
+            file.write(rows[:30])
+        assert mb.append_scraped_hikes(df[10:20]) == 5
+        assert not os.path.exists(f"{mb.scraped_hikes_file}.journal")
+        assert_frame_equal(mb.hikes_from_subsequent_scrapes(), df)
+        assert mb.scraped_urls() == {*df["URL"]}
+
+        df[:8].write_csv(mb.scraped_hikes_file)
+        assert mb.scraped_urls() == {*df[:8]["URL"]}
+    finally:
+        for file in [mb.scraped_hikes_file,
+                     f"{mb.cache_folder}\\{mb.scraped_hikes_file}.urls",
+                     f"{mb.cache_folder}\\{mb.scraped_hikes_file}.urls.key"]:
+            os.remove(file)
+        mb.scraped_hikes_file = real_file
+
+
+def test_cached_manual_overrides():
+    cache_file, key_file = (f"{mb.cache_folder}\\ManualStartEnd.{ext}"
+                            for ext in ("parquet", "key"))
+    for file in (cache_file, key_file):
+        if os.path.exists(file):
+            os.remove(file)
+    mb.cached_ods_frame.cache_clear()
+    df = mb.manual_start_end()
+    assert_frame_equal(df, pl.read_ods("ManualStartEnd.ods",
+                                       schema_overrides={"URL": pl.String}))
+    assert mb.manual_start_end() is df
+    mb.cached_ods_frame.cache_clear()
+    cached_mtime = os.stat(cache_file).st_mtime_ns
+    assert_frame_equal(mb.manual_start_end(), df)
+    assert os.stat(cache_file).st_mtime_ns == cached_mtime
+    os.utime("ManualStartEnd.ods")
+    assert_frame_equal(mb.manual_start_end(), df)
+    with open(key_file, encoding="utf-8") as kf:
+        assert kf.read() == mb.mtimes_key("ManualStartEnd.ods")
+
+
+def test_hike_details_history():
+    real_files = (mb.history_folder, mb.route_store_file, mb.route_stage_file)
+    mb.history_folder, mb.route_store_file, mb.route_stage_file = (
+        "test_history", "test_history_routes.arrow", "test_history_staged.arrow")
+    mb.clear_route_caches()
+    os.makedirs(mb.history_folder, exist_ok=True)
+    shutil.copy("HikeDetails.csv", "HikeDetails.csv.bak")
+    df_later = pl.DataFrame(
+        {
+            "Date": [f"2020-{1 + n // 28:02}-{1 + n % 28:02}" for n in range(50)],
+            "Title": [f"Hike {n}" for n in range(50)],
+            "Attendees": [float(10 + n) for n in range(50)],
+            "URL": [f"test_history_{n}" for n in range(50)],
+            "Source": ["Free"] * 50,
+            "GPX": [f"gpx\\01\\test_history_{n}.gpx" for n in range(50)],
+            "Start": ["A"] * 50, "End": ["B"] * 50,
+            "Distance": [16_000 + n for n in range(50)],
+        },
+        schema=pl.read_csv("HikeDetails.csv", schema_overrides={"URL": pl.String}).schema
+    )
+    dfh = df_later.head(40)
+    df_later = df_later.with_columns(
+        Title=pl.when(pl.int_range(pl.len()) == 3).then(pl.lit("Renamed hike"))
+        .otherwise(pl.col("Title"))
+    )
+    later_urls = df_later["URL"][40:].to_list()
+    try:
+        mb.record_hike_details(dfh, 1_700_000_000)
+        mb.record_hike_details(df_later, 1_700_000_100)
+        mb.record_hike_details(df_later, 1_700_000_200)
+        assert [*mb.history_versions().keys()] == [1_700_000_000, 1_700_000_100]
+        assert len(pl.read_csv(f"{mb.history_folder}\\rows.csv")) == 51
+        assert_frame_equal(mb.read_hike_details("1700000000.csv"), dfh)
+        assert_frame_equal(mb.read_hike_details("1700000100.csv"), df_later)
+
+        for url in [dfh["URL"][0], *later_urls[:2]]:
+            mb.points_to_file([geo.Location(51.5, -0.1), geo.Location(51.6, -0.2)], url)
+        df_later.write_csv("HikeDetails.csv")
+        mb.rollback("1700000000.csv", prune=True)
+        assert_frame_equal(mb.read_hike_details(), dfh)
+        assert all(mb.points_from_file(url) == [] for url in later_urls)
+        assert len(mb.points_from_file(dfh["URL"][0])) == 2
+    finally:
+        shutil.move("HikeDetails.csv.bak", "HikeDetails.csv")
+        for name in ("rows", "versions"):
+            os.remove(f"{mb.history_folder}\\{name}.csv")
+        for file in (mb.route_store_file, mb.route_stage_file):
+            safe_remove(file)
+        mb.history_folder, mb.route_store_file, mb.route_stage_file = real_files
+        mb.clear_route_caches()
+
+
+def test_stage_profile():
+    mb.stage_profiles.clear()
+    route = [geo.Location(51.5 + i / 1000, -0.1) for i in range(2_000)]
+    with mb.profile_stage("not profiling"):
+        pass
+    assert mb.stage_profiles == {}
+    mb.start_profiling()
+    real_report, mb.profile_report_file = mb.profile_report_file, "test_build_profile.json"
+    try:
+        for _ in range(3):
+            mb.calculate_hike_particulars(route)
+        with mb.profile_stage("outer"):
+            with mb.profile_stage("inner"):
+                big_list = [0] * 1_000_000
+            del big_list
+        mb.print_profile_report("test")
+        with open(mb.profile_report_file, encoding="utf-8") as report:
+            runs = json.load(report)
+    finally:
+        mb.profiling = False
+        tracemalloc.stop()
+        safe_remove(mb.profile_report_file)
+        mb.profile_report_file = real_report
+    assert mb.stage_profiles["distance"]["calls"] == 3
+    assert mb.stage_profiles["station lookup"]["seconds"] > 0
+    assert mb.stage_profiles["inner"]["peak_traced_bytes"] >= 8_000_000
+    assert (mb.stage_profiles["outer"]["peak_traced_bytes"] >=
+            mb.stage_profiles["inner"]["peak_traced_bytes"])
+    assert mb.stage_profiles["outer"]["peak_rss_bytes"] > 8_000_000
+    assert runs[-1]["operation"] == "test"
+    assert runs[-1]["stages"] == mb.stage_profiles
+    mb.stage_profiles.clear()
+
+
+def test_batch_gpx_allocation():
+    start_time = arrow.get("2024-06-08T09:00:00Z").datetime
+    stanmore, paddington = (51.6194, -0.3028), (51.5186, -0.1797)
+    route = [(stanmore[0] + (paddington[0] - stanmore[0]) * i / 100,
+              stanmore[1] + (paddington[1] - stanmore[1]) * i / 100,
+              50.0, start_time.replace(minute=i % 60, hour=9 + i // 60))
+             for i in range(101)]
+    gpx_file = "test_batch_allocation.gpx"
+    write_test_gpx(gpx_file, route)
+    df_hikes = pl.DataFrame(
+        [
+            ("2024-06-09", "Round the reservoirs (15 or 20 miles)", 30, "400000001", "Free"),
+            ("2024-06-08", "Stanmore to Paddington (8, 15 or 20 Miles)", 25, "400000002", "Free"),
+            ("2024-06-08", "Something else entirely", 12, "400000003", "Free"),
+            ("2024-06-01", "Paddington Stanmore - 9 miles", 18, "400000004", "Free"),
+        ],
+        schema=["Date", "Title", "Attendees", "URL", "Source"], orient="row"
+    )
+    assert mb.mileages_in_title(df_hikes["Title"][1]) == [8.0, 15.0, 20.0]
+    assert mb.mileages_in_title("Bayford Bluebells (7 or 14 miles)") == [7.0, 14.0]
+    assert mb.mileages_in_title("Every Civilization has its Cradle - 15 (or 11) miles") == [15.0, 11.0]
+    assert mb.mileages_in_title("Epping's end of Autumn Colours (13-14 miles)") == [13.0, 14.0]
+    assert mb.mileages_in_title("The only moat in Middlesex (10 miles + up to 8.5 more)") == [10.0]
+    assert mb.mileages_in_title(df_hikes["Title"][2]) == []
+    df_scores = mb.score_gpx_against_hikes(gpx_file, df_hikes)
+    assert df_scores.rows() == [("400000002", 8), ("400000003", 4),
+                                ("400000004", 4), ("400000001", 2)]
+    assert mb.confident_match(df_scores) == "400000002"
+    assert mb.confident_match(mb.score_gpx_against_hikes(gpx_file, df_hikes[2:])) is None
+
+    real_rules, mb.upload_rules_file = mb.upload_rules_file, "test_gpx_upload_rules.json"
+    bad_files = ["test_batch_malformed.gpx", "test_batch_two_segments.gpx"]
+    with open(bad_files[0], "w", encoding="utf-8") as bad_file:
+        bad_file.write('<?xml version="1.0"?><gpx creator="x"><trk><trkseg><trkpt lat="51"')
+    gpx = gpxpy.gpx.GPX()
+    gpx.tracks.append(gpxpy.gpx.GPXTrack())
+    gpx.tracks[0].segments += [gpxpy.gpx.GPXTrackSegment([gpxpy.gpx.GPXTrackPoint(*pt)])
+                               for pt in route[:2]]
+    with open(bad_files[1], "w", encoding="utf-8") as bad_file:
+        bad_file.write(gpx.to_xml())
+    try:
+        assert mb.uploader_folder(gpx_file) is None
+        assert mb.batch_allocate_gpx_files([*bad_files, gpx_file], df_hikes, interactive=False) == []
+        with open(mb.upload_rules_file, "w", encoding="utf-8") as rules:
+            json.dump([{"folder": "03", "creator": "strava"},
+                       {"folder": "05", "creator": "gpx\\.py", "filename": "^test_batch"},
+                       {"folder": "07"}], rules)
+        assert mb.gpx_uploader_details(gpx_file)["filename"] == gpx_file
+        assert mb.uploader_folder(gpx_file) == "05"
+    finally:
+        safe_remove(mb.upload_rules_file)
+        mb.upload_rules_file = real_rules
+        for file in bad_files:
+            os.remove(file)
+    os.remove(gpx_file)